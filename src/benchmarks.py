@@ -0,0 +1,233 @@
+# Benchmarks for the ontology checker. Run from the repository root:
+#   python src/benchmarks.py [startup] [batch] [parallel] [result_cache] [incremental] [reasoners] [store] [rules] [terms]
+import contextlib
+import io
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+from itertools import cycle, islice
+
+from ontology_cache import load_ontology
+from ontology_checker import REASONER_BACKENDS, OntologyChecker
+from rdflib import Graph
+
+import scenarios
+from facts2triples import convert_schema_to_triples
+from rule_extraction import extract_rules
+from scenarios import SCENARIO_FACTS
+from triple_store import TermDictionary, interned_graph
+
+ONTOLOGY_PATH = "./final_version5.rdf"
+
+
+def _timed(fn, repeats: int):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings), min(timings)
+
+
+def benchmark_startup(repeats: int = 5):
+    # Cold start: RDF/XML parse + RDFS closure, against loading the snapshot written by the first run
+    cache_dir = tempfile.mkdtemp(prefix="ontology_cache_")
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            cold = _timed(lambda: load_ontology(ONTOLOGY_PATH), repeats)
+            load_ontology(ONTOLOGY_PATH, cache_dir)
+            hit = _timed(lambda: load_ontology(ONTOLOGY_PATH, cache_dir), repeats)
+        snapshot_size = sum(os.path.getsize(os.path.join(cache_dir, f)) for f in os.listdir(cache_dir))
+    finally:
+        shutil.rmtree(cache_dir)
+
+    print(f"{'ontology load':<22}{'median':>12}{'min':>12}")
+    print(f"{'cold parse + closure':<22}{cold[0] * 1000:>9.1f} ms{cold[1] * 1000:>9.1f} ms")
+    print(f"{'snapshot hit':<22}{hit[0] * 1000:>9.1f} ms{hit[1] * 1000:>9.1f} ms")
+    print(f"Speedup {cold[0] / hit[0]:.1f}x, snapshot size {snapshot_size / 1024:.0f} KiB")
+
+
+def _quiet_checker(result_cache_size: int = 0, **options) -> OntologyChecker:
+    # The result cache is off unless asked for, otherwise repeated runs only measure lookups
+    with contextlib.redirect_stdout(io.StringIO()):
+        return OntologyChecker(ONTOLOGY_PATH, result_cache_size=result_cache_size, **options)
+
+
+def _fact_sets(size: int):
+    return list(islice(cycle(SCENARIO_FACTS.values()), size))
+
+
+def benchmark_batch(sizes=(1, 4, 16, 64, 256)):
+    # One check_consistency call per story against a single check_consistency_batch call. The
+    # batch only saves the caller the loop: both columns should stay within noise of each other
+    checker = _quiet_checker()
+    print(f"{'stories':>8}{'calls':>12}{'batch':>12}{'calls/s':>12}{'batch/s':>12}")
+    for size in sizes:
+        fact_sets = _fact_sets(size)
+        with contextlib.redirect_stdout(io.StringIO()):
+            singles = [checker.check_consistency(facts) for facts in fact_sets]
+            assert checker.check_consistency_batch(fact_sets) == singles
+            calls = _timed(lambda: [checker.check_consistency(facts) for facts in fact_sets], 3)[0]
+            batch = _timed(lambda: checker.check_consistency_batch(fact_sets), 3)[0]
+        print(f"{size:>8}{calls * 1000:>9.1f} ms{batch * 1000:>9.1f} ms{size / calls:>12.0f}{size / batch:>12.0f}")
+
+
+def benchmark_parallel(stories: int = 512):
+    # Scaling of check_consistency_parallel from one worker to every available core
+    checker = _quiet_checker()
+    fact_sets = _fact_sets(stories)
+    max_workers = os.cpu_count() or 1
+    worker_counts = sorted({1, 2, 4, 8, 16, max_workers} & set(range(1, max_workers + 1)))
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        expected = checker.check_consistency_batch(fact_sets)
+    print(f"{stories} stories, {max_workers} cores")
+    print(f"{'workers':>8}{'time':>12}{'stories/s':>12}{'speedup':>10}")
+    baseline = None
+    for workers in worker_counts:
+        with contextlib.redirect_stdout(io.StringIO()):
+            assert checker.check_consistency_parallel(fact_sets, workers) == expected
+            elapsed = _timed(lambda: checker.check_consistency_parallel(fact_sets, workers), 3)[0]
+        baseline = baseline or elapsed
+        print(f"{workers:>8}{elapsed * 1000:>9.1f} ms{stories / elapsed:>12.0f}{baseline / elapsed:>9.2f}x")
+
+
+def benchmark_result_cache(repeats: int = 5):
+    # Cost of a check against a result-cache hit, per scenario; the facts are shuffled
+    # between calls so the hit also covers the canonical ordering of the key
+    uncached = _quiet_checker()
+    cached = _quiet_checker(result_cache_size=len(SCENARIO_FACTS))
+    print(f"{'scenario':<16}{'check':>12}{'cache hit':>12}{'speedup':>10}")
+    for name, facts in SCENARIO_FACTS.items():
+        with contextlib.redirect_stdout(io.StringIO()):
+            expected = uncached.check_consistency(facts)
+            assert cached.check_consistency(facts) == expected
+            assert cached.check_consistency(list(reversed(facts))) == expected
+            check = _timed(lambda: uncached.check_consistency(facts), repeats)[0]
+            hit = _timed(lambda: cached.check_consistency(facts), repeats)[0]
+        print(f"{name:<16}{check * 1000:>9.2f} ms{hit * 1000:>9.2f} ms{check / hit:>9.1f}x")
+    print(cached.result_cache.stats())
+
+
+def benchmark_incremental(repeats: int = 5):
+    # A rewrite-iteration-sized edit (one fact replaced) rechecked from scratch against a
+    # recheck diffed with the state of the previous check. Layers smaller than
+    # INCREMENTAL_MIN_LAYER are checked in full by both, so only the large ones should differ.
+    checker = _quiet_checker()
+    print(f"{'scenario':<16}{'full':>12}{'incremental':>14}{'speedup':>10}")
+    for name, facts in SCENARIO_FACTS.items():
+        edited = facts[:-1] + [(facts[-1][0], facts[-1][1], "demo:Edited")]
+        with contextlib.redirect_stdout(io.StringIO()):
+            _, state = checker.check_consistency_incremental(facts)
+            expected = checker.check_consistency(edited)
+            assert sorted(checker.check_consistency_incremental(edited, state)[0]) == sorted(expected)
+            full = _timed(lambda: checker.check_consistency(edited), repeats)[0]
+            incremental = _timed(lambda: checker.check_consistency_incremental(edited, state), repeats)[0]
+        print(f"{name:<16}{full * 1000:>9.2f} ms{incremental * 1000:>11.2f} ms{full / incremental:>9.1f}x")
+
+
+def benchmark_reasoners(stories: int = 64):
+    # Base closure and batch check time of each reasoning backend
+    fact_sets = _fact_sets(stories)
+    print(f"{'backend':<10}{'closure':>10}{'base size':>11}{'batch':>12}{'stories/s':>12}")
+    expected = None
+    for backend in REASONER_BACKENDS:
+        checker = _quiet_checker(reasoner_backend=backend)
+        with contextlib.redirect_stdout(io.StringIO()):
+            violations = checker.check_consistency_batch(fact_sets)
+            batch = _timed(lambda: checker.check_consistency_batch(fact_sets), 3)[0]
+        expected = expected or [Counter(v) for v in violations]
+        assert [Counter(v) for v in violations] == expected
+        print(f"{backend:<10}{checker.base_closure_time * 1000:>7.0f} ms{len(checker.reasoner.closure_graph):>11}"
+              f"{batch * 1000:>9.1f} ms{stories / batch:>12.0f}")
+
+
+def benchmark_store(stories: int = 256):
+    # Memory and pattern lookups of the story layers (facts and their inferences) kept in
+    # rdflib's default Memory store against the interned store
+    checker = _quiet_checker()
+    with contextlib.redirect_stdout(io.StringIO()):
+        layers = [list(checker.reasoner.expand(checker._facts_graph(facts))) for facts in _fact_sets(stories)]
+    patterns = [(s, p, None) for layer in layers for s, p, _ in layer] + [(None, p, o) for layer in layers for _, p, o in layer]
+
+    def memory_graph(triples):
+        graph = Graph()
+        for triple in triples:
+            graph.add(triple)
+        return graph
+
+    def overlay_graph(triples):
+        return interned_graph(TermDictionary(checker.terms), triples)
+
+    print(f"{stories} story layers, {sum(map(len, layers)) / stories:.1f} triples each")
+    print(f"{'store':<10}{'bytes/story':>12}{'build':>12}{'lookups':>12}")
+    for name, build in (("memory", memory_graph), ("interned", overlay_graph)):
+        tracemalloc.start()
+        graphs = [build(layer) for layer in layers]
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        elapsed = _timed(lambda: [build(layer) for layer in layers], 3)[0]
+        lookups = _timed(lambda: [len(list(graph.triples(pattern))) for graph in graphs[:16] for pattern in patterns], 3)[0]
+        print(f"{name:<10}{size / stories:>12.0f}{elapsed * 1000:>9.1f} ms{lookups * 1000:>9.1f} ms")
+
+
+def benchmark_rules(repeats: int = 20):
+    # Sentences of each scenario the rule extraction covers, its facts (other than types)
+    # that the reference extraction (SCENARIO_FACTS) also has, and whether the extractor
+    # call is skipped
+    print(f"{'scenario':<15}{'covered':>9}{'facts':>7}{'agree':>7}{'time':>11}  extractor")
+    for name, expected in SCENARIO_FACTS.items():
+        story = getattr(scenarios, name)
+        rules = extract_rules(story)
+        elapsed = _timed(lambda: extract_rules(story), repeats)[0]
+        with contextlib.redirect_stdout(io.StringIO()):
+            facts = convert_schema_to_triples(rules.data)
+        # Compared without the subject: weather records and trips get their IDs from the extractor
+        values = [(p, o) for _, p, o in facts if p != "rdf:type"]
+        agree = sum(value in {(p, o) for _, p, o in expected} for value in values)
+        print(f"{name:<15}{rules.covered:>4} / {rules.sentences:<2}{len(values):>7}{agree:>7}{elapsed * 1000:>8.2f} ms"
+              f"  {'skipped' if rules.complete else 'called'}")
+
+
+def benchmark_terms(stories: int = 2048, report_every: int = 256):
+    # Memory held by the checker across many stories with names of their own: the ontology's
+    # term dictionary and the traced memory should stay flat once the bounded caches are warm
+    checker = _quiet_checker()
+
+    def renamed(facts, n):
+        return [tuple(f"{term}_{n}" if isinstance(term, str) and term.startswith("demo:") else term
+                      for term in fact) for fact in facts]
+
+    print(f"{'stories':>8}{'terms':>10}{'traced':>12}")
+    tracemalloc.start()
+    for n, facts in enumerate(_fact_sets(stories), 1):
+        with contextlib.redirect_stdout(io.StringIO()):
+            _, state = checker.check_consistency_incremental(renamed(facts, n))
+            checker.check_consistency_incremental(renamed(facts, n)[:-1], state)
+        if n % report_every == 0:
+            print(f"{n:>8}{len(checker.terms):>10}{tracemalloc.get_traced_memory()[0] / 1024 / 1024:>9.1f} MiB")
+    tracemalloc.stop()
+
+
+BENCHMARKS = {
+    "startup": benchmark_startup,
+    "batch": benchmark_batch,
+    "parallel": benchmark_parallel,
+    "result_cache": benchmark_result_cache,
+    "incremental": benchmark_incremental,
+    "reasoners": benchmark_reasoners,
+    "store": benchmark_store,
+    "rules": benchmark_rules,
+    "terms": benchmark_terms,
+}
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        print(f"=== {name} ===")
+        BENCHMARKS[name]()
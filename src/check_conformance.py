@@ -0,0 +1,89 @@
+# Conformance checks: checks the facts of every scenario in scenarios.py with a reference
+# checker and with an alternative one, and reports any difference in the violation rows.
+# Usage (from the repository root):
+#   python src/check_conformance.py [engines] [modules] [reasoners]
+import contextlib
+import io
+import sys
+import time
+from collections import Counter
+from typing import NamedTuple
+
+from ontology_checker import OntologyChecker
+from scenarios import SCENARIO_FACTS
+
+ONTOLOGY_PATH = "./final_version5.rdf"
+
+
+class Comparison(NamedTuple):
+    reference: str
+    candidate: str
+    # OntologyChecker options of the alternative checker
+    options: dict
+    # The rule engines (use_native_rules) both checkers run with; None compares the engines
+    # themselves, the reference with SPARQL and the candidate with the native rules
+    engines: tuple = (False, True)
+    summary: str = ""
+
+
+COMPARISONS = {
+    "engines": Comparison("sparql", "native", {}, engines=None,
+                          summary="Native rules match the SPARQL queries on every scenario."),
+    "modules": Comparison("full", "module", {"use_modules": True},
+                          summary="Module checking matches whole-ontology checking on every scenario."),
+    "reasoners": Comparison("owlrl", "minimal", {"reasoner_backend": "minimal"},
+                            summary="The minimal reasoner matches the owlrl RDFS reasoner on every scenario."),
+}
+
+
+def timed_check(checker: OntologyChecker, facts, use_native_rules: bool):
+    checker.use_native_rules = use_native_rules
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        violations = checker.check_consistency(facts)
+    return violations, time.perf_counter() - start
+
+
+def run_comparison(comparison: Comparison) -> bool:
+    # Without the result cache a second check would just reuse the rows of the first
+    with contextlib.redirect_stdout(io.StringIO()):
+        reference = OntologyChecker(ONTOLOGY_PATH, result_cache_size=0)
+        candidate = OntologyChecker(ONTOLOGY_PATH, result_cache_size=0, **comparison.options)
+    runs = [(False, True)] if comparison.engines is None else [(engine, engine) for engine in comparison.engines]
+
+    report = []
+    for name, facts in SCENARIO_FACTS.items():
+        same, times = True, []
+        for reference_engine, candidate_engine in runs:
+            # The candidate is checked twice: the first check may build per-fact-set state
+            # (e.g. the module of the facts) that later ones reuse
+            timed_check(candidate, facts, candidate_engine)
+            expected, reference_time = timed_check(reference, facts, reference_engine)
+            violations, candidate_time = timed_check(candidate, facts, candidate_engine)
+            same = same and Counter(expected) == Counter(violations)
+            times += [reference_time, candidate_time]
+        report.append((name, same, len(expected), times))
+
+    labels = [comparison.reference, comparison.candidate]
+    if comparison.engines is not None:
+        labels = [f"{label} {'native' if engine else 'sparql'}" for engine in comparison.engines for label in labels]
+    print(f"{'scenario':<16}{'match':<7}{'rows':>5}" + "".join(f"{label:>18}" for label in labels))
+    for name, same, rows, times in report:
+        print(f"{name:<16}{str(same):<7}{rows:>5}" + "".join(f"{t * 1000:>15.2f} ms" for t in times))
+
+    mismatches = [name for name, same, *_ in report if not same]
+    if mismatches:
+        print(f"{comparison.candidate} disagrees with {comparison.reference} on: {', '.join(mismatches)}")
+        return False
+    print(comparison.summary)
+    return True
+
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(COMPARISONS)
+    results = []
+    for name in names:
+        print(f"=== {name} ===")
+        results.append(run_comparison(COMPARISONS[name]))
+    if not all(results):
+        sys.exit(1)
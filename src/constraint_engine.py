@@ -0,0 +1,248 @@
+from collections import defaultdict
+from decimal import Decimal, InvalidOperation
+from itertools import chain
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from rdflib import Graph, Literal, Namespace
+from rdflib.namespace import RDF, OWL
+from rdflib.plugins.sparql.operators import numeric
+from rdflib.plugins.sparql.sparql import SPARQLError
+
+DEMO = Namespace("http://www.semanticweb.org/alexandrosxanthopoulos/ontologies/2025/9/ProjectDemo#")
+IA2025 = Namespace("http://example.org/ia2025#")
+CITY = Namespace("http://www.semanticweb.org/gwiazdk01/ontologies/2025/8/untitled-ontology-4#")
+TRAVEL = Namespace("http://www.semanticweb.org/rubyorsmth/ontologies/2025/9/untitled-ontology-5#")
+
+TRUE = Literal(True)
+
+Row = Tuple[Any, ...]
+
+
+class TripleIndex:
+    # Hash indexes predicate -> subject -> objects and predicate -> object -> subjects.
+    # A story index is layered over the shared index of the ontology closure; the layers
+    # never hold the same triple, so lookups just chain both.
+    def __init__(self, graph: Graph, parent: Optional["TripleIndex"] = None):
+        self.parent = parent
+        self.pso = defaultdict(lambda: defaultdict(set))
+        self.pos = defaultdict(lambda: defaultdict(set))
+        for s, p, o in graph:
+            self.pso[p][s].add(o)
+            self.pos[p][o].add(s)
+
+    def objects(self, s, p) -> Iterable:
+        own = self.pso[p].get(s, ()) if p in self.pso else ()
+        return chain(self.parent.objects(s, p), own) if self.parent else own
+
+    def subjects(self, p, o) -> Iterable:
+        own = self.pos[p].get(o, ()) if p in self.pos else ()
+        return chain(self.parent.subjects(p, o), own) if self.parent else own
+
+    def pairs(self, p) -> Iterable[Tuple[Any, Any]]:
+        own = ((s, o) for s, objects in self.pso[p].items() for o in objects) if p in self.pso else ()
+        return chain(self.parent.pairs(p), own) if self.parent else own
+
+    def has(self, s, p, o) -> bool:
+        if p in self.pso and o in self.pso[p].get(s, ()):
+            return True
+        return self.parent.has(s, p, o) if self.parent else False
+
+
+# The helpers below follow rdflib's SPARQL operator semantics, so that the native rules
+# return exactly the rows (terms and multiplicities) of the corresponding queries.
+def _compare(term, op: str, other) -> bool:
+    # A comparison that raises a SPARQL error simply fails the FILTER
+    if not isinstance(term, Literal):
+        return False
+    try:
+        result = getattr(term, op)(other if isinstance(other, Literal) else Literal(other))
+    except TypeError:
+        return False
+    return result is True
+
+
+def _divide(a, b) -> Optional[Literal]:
+    try:
+        result = Decimal(numeric(a))
+        divisor = numeric(b)
+        if type(divisor) == float:
+            result = float(result)
+        result /= divisor
+    except (SPARQLError, InvalidOperation, ZeroDivisionError):
+        return None
+    return Literal(result)
+
+
+def _different(a, b) -> bool:
+    try:
+        return a.neq(b) is True
+    except TypeError:
+        return False
+
+
+def rule_allergy(index: TripleIndex) -> List[Row]:
+    rows = []
+    for person, ingredient in index.pairs(DEMO.isAllergicTo):
+        for food in index.objects(person, DEMO.eats):
+            if index.has(ingredient, IA2025.isPartOf, food):
+                rows.append((person, food, ingredient))
+    return rows
+
+
+def rule_drivable_city_obesity(index: TripleIndex) -> List[Row]:
+    rows = []
+    for person, city in index.pairs(DEMO.livesIn):
+        if index.has(city, RDF.type, CITY.DrivableCity) and not index.has(person, DEMO.hasCondition,
+                                                                          CITY.ObesityIncrease):
+            rows.append((person, city))
+    return rows
+
+
+def rule_underage_marriage(index: TripleIndex) -> List[Row]:
+    rows = []
+    married = [person for person, _ in index.pairs(DEMO.isMarriedTo)]
+    married += [person for _, person in index.pairs(DEMO.isMarriedTo)]
+    for person in married:
+        if index.has(person, RDF.type, DEMO.AdultPerson):
+            continue
+        for age in index.objects(person, DEMO.hasAge):
+            if _compare(age, "__lt__", 18):
+                rows.append((person, age))
+    return rows
+
+
+def rule_conflicting_traits(index: TripleIndex) -> List[Row]:
+    return [(person,) for person in index.subjects(DEMO.isReserved, TRUE)
+            if index.has(person, DEMO.isTalkative, TRUE)]
+
+
+def rule_baker_missing_oven(index: TripleIndex) -> List[Row]:
+    rows = []
+    for person in index.subjects(DEMO.worksAs, DEMO.Baker):
+        if index.has(person, RDF.type, DEMO.Person) and not any(True for _ in index.objects(person, DEMO.usesTool)):
+            rows.append((person,))
+    return rows
+
+
+def rule_disjoint_health_conditions(index: TripleIndex) -> List[Row]:
+    rows = []
+    for person, condition1 in index.pairs(DEMO.hasCondition):
+        for condition2 in index.objects(person, DEMO.hasCondition):
+            if not _different(condition1, condition2):
+                continue
+            if not _compare(Literal(str(condition1)), "__lt__", Literal(str(condition2))):
+                continue
+            matches = index.has(condition1, OWL.disjointWith, condition2) + index.has(condition2, OWL.disjointWith,
+                                                                                     condition1)
+            rows.extend([(person, condition1, condition2)] * matches)
+    return rows
+
+
+def rule_walkable_mountain_city(index: TripleIndex) -> List[Row]:
+    return [(city,) for city in index.subjects(CITY.hasTerrain, CITY.Mountainous)
+            if index.has(city, RDF.type, CITY.WalkableCity)]
+
+
+def rule_landmark_multiple_cities(index: TripleIndex) -> List[Row]:
+    cities = defaultdict(set)
+    for landmark, city in index.pairs(CITY.locatedIn):
+        cities[landmark].add(city)
+    return [(landmark, Literal(len(located))) for landmark, located in cities.items() if len(located) > 1]
+
+
+def rule_subway_no_city(index: TripleIndex) -> List[Row]:
+    return [(subway,) for subway in index.subjects(RDF.type, CITY.SubwaySystem)
+            if not any(True for _ in index.objects(subway, CITY.locatedIn))]
+
+
+def rule_city_size_population_mismatch(index: TripleIndex) -> List[Row]:
+    rows = []
+    for city, population in index.pairs(CITY.hasPopulation):
+        if index.has(city, RDF.type, CITY.LargeCity) and _compare(population, "__lt__", 1000000):
+            rows.append((city, population, Literal("LargeCity")))
+        if index.has(city, RDF.type, CITY.MediumCity) and (
+                _compare(population, "__lt__", 100000) or _compare(population, "__ge__", 1000000)):
+            rows.append((city, population, Literal("MediumCity")))
+        if index.has(city, RDF.type, CITY.SmallCity) and _compare(population, "__ge__", 100000):
+            rows.append((city, population, Literal("SmallCity")))
+    return rows
+
+
+def rule_adjacent_completion(index: TripleIndex) -> List[Row]:
+    return [(city_a, city_b) for city_a, city_b in index.pairs(CITY.adjacentTo)
+            if not index.has(city_b, CITY.adjacentTo, city_a)]
+
+
+def rule_desert_climate_food(index: TripleIndex) -> List[Row]:
+    rows = []
+    for climate in index.subjects(TRAVEL.hasClimateZone, TRAVEL.Desert):
+        if index.has(climate, RDF.type, TRAVEL.Climate):
+            rows.extend((climate, food) for food in index.objects(climate, TRAVEL.allowsForFood))
+    return rows
+
+
+def rule_snow_above_zero(index: TripleIndex) -> List[Row]:
+    rows = []
+    for record in index.subjects(TRAVEL.weatherHasState, TRAVEL.Snow):
+        rows.extend((record, temp) for temp in index.objects(record, TRAVEL.temperature)
+                    if _compare(temp, "__gt__", 0))
+    return rows
+
+
+def travel_limit_rules(mode, max_distance: float, max_speed: float) -> Dict[str, Callable[[TripleIndex], List[Row]]]:
+    # Builds the distance, speed and cost rules of one travel mode (STORY_15 queries)
+    def distance(index: TripleIndex) -> List[Row]:
+        rows = []
+        for event in index.subjects(TRAVEL.hasTravelMode, mode):
+            rows.extend((event, dist) for dist in index.objects(event, TRAVEL.travelDistance)
+                        if _compare(dist, "__gt__", max_distance))
+        return rows
+
+    def speed(index: TripleIndex) -> List[Row]:
+        rows = []
+        for event in index.subjects(TRAVEL.hasTravelMode, mode):
+            for dist in index.objects(event, TRAVEL.travelDistance):
+                for duration in index.objects(event, TRAVEL.travelDurationHours):
+                    if not _compare(duration, "__gt__", 0):
+                        continue
+                    event_speed = _divide(dist, duration)
+                    if event_speed is not None and _compare(event_speed, "__gt__", max_speed):
+                        rows.append((event, dist, duration, event_speed))
+        return rows
+
+    def cost(index: TripleIndex) -> List[Row]:
+        rows = []
+        for event in index.subjects(TRAVEL.hasTravelMode, mode):
+            rows.extend((event, event_cost) for event_cost in index.objects(event, TRAVEL.travelCost)
+                        if _compare(event_cost, "__gt__", 0))
+        return rows
+
+    return {"distance": distance, "speed": speed, "cost": cost}
+
+
+_walking = travel_limit_rules(TRAVEL.Walking, 20, 6)
+_cycling = travel_limit_rules(TRAVEL.Cycling, 50, 25)
+
+# Native versions of the queries in queries.ALL_QUERIES, keyed by the same names.
+# Queries without an entry here are evaluated with SPARQL by the OntologyChecker.
+NATIVE_RULES = {
+    "allergy_violation": rule_allergy,
+    "drivable_city_obesity_missing": rule_drivable_city_obesity,
+    "underage_marriage": rule_underage_marriage,
+    "conflicting_traits": rule_conflicting_traits,
+    "baker_missing_oven": rule_baker_missing_oven,
+    "disjoint_health_conditions": rule_disjoint_health_conditions,
+    "walkable_mountain_city": rule_walkable_mountain_city,
+    "landmark_multiple_cities": rule_landmark_multiple_cities,
+    "subway_no_city": rule_subway_no_city,
+    "city_size_population_mismatch": rule_city_size_population_mismatch,
+    "adjacent_to_completion": rule_adjacent_completion,
+    "desert_climate_food": rule_desert_climate_food,
+    "snow_above_zero": rule_snow_above_zero,
+    "walking_distance_violation": _walking["distance"],
+    "walking_speed_violation": _walking["speed"],
+    "walking_cost_violation": _walking["cost"],
+    "cycling_distance_violation": _cycling["distance"],
+    "cycling_speed_violation": _cycling["speed"],
+    "cycling_cost_violation": _cycling["cost"],
+}
@@ -0,0 +1,256 @@
+from functools import lru_cache
+from itertools import chain
+from typing import Iterable, Iterator, List, Optional, Set, Tuple, Any
+
+from owlrl import DeductiveClosure, RDFS_Semantics
+from rdflib import Graph, Literal
+from rdflib.namespace import RDF, RDFS
+
+from triple_store import InternedStore, TermDictionary, interned_graph
+
+Triple = Tuple[Any, Any, Any]
+
+BASE_LOOKUP_CACHE_SIZE = 65536
+
+
+class DeltaRDFSReasoner:
+    # Reproduces DeductiveClosure(RDFS_Semantics).expand(base + facts) without re-running
+    # the closure over the ontology: the base closure is computed once, and each call only
+    # derives the triples that the new facts add on top of it (semi-naive evaluation).
+
+    # The axiomatic consequences of RDFS semantics: rdf:Property and rdfs:Resource types (rdf1,
+    # rdfs4), reflexive subproperties and subclasses (rdfs6, rdfs10), rdfs8, rdfs12 and the
+    # rdfs:Literal superclass of datatypes
+    axiomatic_rules = True
+
+    def __init__(self, base_graph: Graph, closure_graph: Optional[Graph] = None,
+                 terms: Optional[TermDictionary] = None):
+        self.base_graph = base_graph
+        self.base_literals = {o for o in base_graph.objects() if isinstance(o, Literal)}
+        # The closure and every story layer are interned stores sharing one term dictionary
+        self.terms = terms if terms is not None else TermDictionary()
+
+        # The closure can be passed in when it was already computed (e.g. from a snapshot)
+        if closure_graph is None:
+            closure_graph = self._materialize(base_graph)
+        if not isinstance(closure_graph.store, InternedStore):
+            closure_graph = interned_graph(self.terms, closure_graph)
+        self.closure_graph = closure_graph
+
+        # The base closure never changes, so its pattern lookups are shared by all stories
+        # (most stories ask for the same domains, ranges and superclasses). Patterns with a
+        # story's own terms match nothing there and are not cached (see _triples).
+        self._base_triples = lru_cache(maxsize=BASE_LOOKUP_CACHE_SIZE)(
+            lambda pattern: tuple(self.closure_graph.store.match(pattern)))
+
+    def expand(self, facts: Graph, seed: Optional[Set[Triple]] = None) -> Graph:
+        # Returns only the triples missing from the base closure, i.e. the closure of
+        # base + facts is exactly closure_graph + the returned graph. The layer interns its
+        # terms in the dictionary of the facts (the story's overlay, see TermDictionary).
+        terms = facts.store.terms if isinstance(facts.store, InternedStore) else None
+        return self._derive(self.seed(facts) if seed is None else seed, terms)
+
+    def update(self, seed: Set[Triple], previous_seed: Set[Triple],
+               previous_delta: Graph) -> Tuple[Graph, Optional[Set[Triple]]]:
+        # Same result as expand() for the facts of seed, starting from the delta of an earlier
+        # fact set (DRed): everything derived through a removed triple is retracted, whatever
+        # still follows from the remaining triples is re-derived, and the added facts are
+        # propagated as usual. previous_delta itself is left untouched. Also returns the
+        # triples that may differ between the two deltas (None when the delta was derived
+        # from scratch).
+        previous = previous_delta.store
+        removed = [t for t in previous_seed - seed if previous.has(t)]
+
+        # Re-deriving most of the layer costs more than deriving it from scratch
+        max_deleted = len(previous_delta) // 2
+        deleted = set(removed)
+        pending = list(removed)
+        while pending:
+            if len(deleted) > max_deleted:
+                return self._derive(seed, previous.terms), None
+            t = pending.pop()
+            for new_t in self._consequences(previous_delta, t):
+                if new_t not in deleted and previous.has(new_t):
+                    deleted.add(new_t)
+                    pending.append(new_t)
+
+        # The copy is made on the interned IDs; the deleted triples are then taken out of it
+        delta = Graph(store=previous.copy())
+        for t in deleted:
+            delta.store.remove_triple(t)
+        first_added = len(delta.store.subjects)
+        pending = [t for t in (seed - previous_seed) | (seed & deleted) if self._store(delta, t)]
+
+        # Deleted triples still derivable in one step from the remaining ones come back here;
+        # those depending on new or re-derived triples are found again by the saturation
+        for t in deleted:
+            if not delta.store.has(t) and self._derivable(delta, t) and self._store(delta, t):
+                pending.append(t)
+        delta = self._saturate(delta, pending)
+        return delta, deleted.union(delta.store.rows_since(first_added))
+
+    def _derive(self, seed: Set[Triple], terms: Optional[TermDictionary] = None) -> Graph:
+        delta = interned_graph(terms if terms is not None else self.terms)
+        pending = [t for t in seed if self._store(delta, t)]
+        return self._saturate(delta, pending)
+
+    def _materialize(self, base_graph: Graph) -> Graph:
+        closure_graph = Graph()
+        closure_graph += base_graph
+        DeductiveClosure(RDFS_Semantics).expand(closure_graph)
+        return closure_graph
+
+    def seed(self, facts: Graph) -> Set[Triple]:
+        # The triples the closure starts from: the facts, their same-value literal copies and
+        # their rdfs4 resource types (owlrl only applies rdfs4a/rdfs4b to the asserted triples)
+        seed = set(facts) | self._literal_copies(facts)
+        if not self.axiomatic_rules:
+            return seed
+        for s, p, o in list(seed):
+            seed.add((s, RDF.type, RDFS.Resource))
+            seed.add((o, RDF.type, RDFS.Resource))
+        return seed
+
+    def _saturate(self, delta: Graph, pending: List[Triple]) -> Graph:
+        while pending:
+            t = pending.pop()
+            for new_t in self._consequences(delta, t):
+                if self._store(delta, new_t):
+                    pending.append(new_t)
+        return delta
+
+    def _literal_copies(self, facts: Graph) -> Set[Triple]:
+        # owlrl's one-time rule: a triple with a literal object is duplicated for every other
+        # literal with the same value. Pairs of base literals are already in the base closure.
+        fact_literals = {o for o in facts.objects() if isinstance(o, Literal)}
+        if not fact_literals:
+            return set()
+        all_literals = self.base_literals | fact_literals
+
+        same_value = set()
+        for lt1 in fact_literals:
+            for lt2 in all_literals:
+                if lt1 is not lt2 and RDFS_Semantics._literals_same_as(lt1, lt2):
+                    same_value.add((lt1, lt2))
+                    same_value.add((lt2, lt1))
+
+        copies = set()
+        for lt1, lt2 in same_value:
+            for s, p, _ in chain(self.base_graph.triples((None, None, lt1)), facts.triples((None, None, lt1))):
+                copies.add((s, p, lt2))
+        return copies
+
+    def _store(self, delta: Graph, t: Triple) -> bool:
+        if isinstance(t[1], Literal) or self.closure_graph.store.has(t):
+            return False
+        return delta.store.add_triple(t)
+
+    def _triples(self, delta: Graph, pattern: Triple) -> Iterator[Triple]:
+        lookup = self.closure_graph.store.terms.lookup
+        if any(term is not None and lookup(term) is None for term in pattern):
+            return delta.store.match(pattern)
+        return chain(self._base_triples(pattern), delta.store.match(pattern))
+
+    def _consequences(self, delta: Graph, t: Triple) -> Iterable[Triple]:
+        # The RDFS rules of owlrl's RDFS_Semantics.rules, evaluated with t in every premise position.
+        s, p, o = t
+        # rdf1
+        if self.axiomatic_rules:
+            yield p, RDF.type, RDF.Property
+
+        # rdfs2 / rdfs3
+        if p == RDFS.domain:
+            for u, _, _ in self._triples(delta, (None, s, None)):
+                yield u, RDF.type, o
+        if p == RDFS.range:
+            for _, _, v in self._triples(delta, (None, s, None)):
+                yield v, RDF.type, o
+        for _, _, c in self._triples(delta, (p, RDFS.domain, None)):
+            yield s, RDF.type, c
+        for _, _, c in self._triples(delta, (p, RDFS.range, None)):
+            yield o, RDF.type, c
+
+        # rdfs5 / rdfs7
+        if p == RDFS.subPropertyOf:
+            for _, _, x in self._triples(delta, (o, RDFS.subPropertyOf, None)):
+                yield s, RDFS.subPropertyOf, x
+            for x, _, _ in self._triples(delta, (None, RDFS.subPropertyOf, s)):
+                yield x, RDFS.subPropertyOf, o
+            for z, _, w in self._triples(delta, (None, s, None)):
+                yield z, o, w
+        for _, _, b in self._triples(delta, (p, RDFS.subPropertyOf, None)):
+            yield s, b, o
+
+        # rdfs9 / rdfs11
+        if p == RDFS.subClassOf:
+            for v, _, _ in self._triples(delta, (None, RDF.type, s)):
+                yield v, RDF.type, o
+            for _, _, x in self._triples(delta, (o, RDFS.subClassOf, None)):
+                yield s, RDFS.subClassOf, x
+            for x, _, _ in self._triples(delta, (None, RDFS.subClassOf, s)):
+                yield x, RDFS.subClassOf, o
+
+        if p == RDF.type:
+            for _, _, b in self._triples(delta, (o, RDFS.subClassOf, None)):
+                yield s, RDF.type, b
+            if not self.axiomatic_rules:
+                return
+            # rdfs6
+            if o == RDF.Property:
+                yield s, RDFS.subPropertyOf, s
+            # rdfs8 / rdfs10
+            if o == RDFS.Class:
+                yield s, RDFS.subClassOf, RDFS.Resource
+                yield s, RDFS.subClassOf, s
+            # rdfs12
+            if o == RDFS.ContainerMembershipProperty:
+                yield s, RDFS.subPropertyOf, RDFS.member
+            if o == RDFS.Datatype:
+                yield s, RDFS.subClassOf, RDFS.Literal
+
+    def _exists(self, delta: Graph, pattern: Triple) -> bool:
+        return any(True for _ in self._triples(delta, pattern))
+
+    def _derivable(self, delta: Graph, t: Triple) -> bool:
+        # The rules of _consequences read backwards: does some rule derive t from the base
+        # closure and delta? (rdfs4 and the literal copies are part of the seed)
+        s, p, o = t
+        for a, _, _ in self._triples(delta, (None, RDFS.subPropertyOf, p)):
+            if a != p and self._exists(delta, (s, a, o)):
+                return True
+
+        if p == RDF.type:
+            if o == RDF.Property and self.axiomatic_rules and self._exists(delta, (None, s, None)):
+                return True
+            # Walked from s, which has far fewer triples than e.g. the subclasses of rdfs:Resource
+            for _, q, v in self._triples(delta, (s, None, None)):
+                if self._exists(delta, (q, RDFS.domain, o)):
+                    return True
+                if q == RDF.type and v != o and self._exists(delta, (v, RDFS.subClassOf, o)):
+                    return True
+            for _, q, _ in self._triples(delta, (None, None, s)):
+                if self._exists(delta, (q, RDFS.range, o)):
+                    return True
+        elif p == RDFS.subPropertyOf:
+            if self.axiomatic_rules and self._axiomatic_subproperty(delta, s, o):
+                return True
+            for _, _, b in self._triples(delta, (s, RDFS.subPropertyOf, None)):
+                if b != o and self._exists(delta, (b, RDFS.subPropertyOf, o)):
+                    return True
+        elif p == RDFS.subClassOf:
+            if self.axiomatic_rules and self._axiomatic_subclass(delta, s, o):
+                return True
+            for _, _, b in self._triples(delta, (s, RDFS.subClassOf, None)):
+                if b != o and self._exists(delta, (b, RDFS.subClassOf, o)):
+                    return True
+        return False
+
+    def _axiomatic_subproperty(self, delta: Graph, s, o) -> bool:
+        # rdfs6 / rdfs12
+        return (s == o and self._exists(delta, (s, RDF.type, RDF.Property))) or (
+                o == RDFS.member and self._exists(delta, (s, RDF.type, RDFS.ContainerMembershipProperty)))
+
+    def _axiomatic_subclass(self, delta: Graph, s, o) -> bool:
+        # rdfs8 / rdfs10 / datatypes
+        return ((o == RDFS.Resource or s == o) and self._exists(delta, (s, RDF.type, RDFS.Class))) or (
+                o == RDFS.Literal and self._exists(delta, (s, RDF.type, RDFS.Datatype)))
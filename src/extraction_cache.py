@@ -0,0 +1,66 @@
+import hashlib
+import json
+import sqlite3
+import time
+from typing import Any, Dict, Optional
+
+
+def extraction_key(story: str, model: str, options: Dict[str, Any], prompt_template: str) -> str:
+    # Everything the extractor output depends on: another model, sampling option or prompt
+    # wording never hits an entry made with the old one
+    parts = [model, json.dumps(options, sort_keys=True, default=str), prompt_template, story]
+    return hashlib.sha256("\0".join(parts).encode("utf-8")).hexdigest()
+
+
+class ExtractionCache:
+    # Raw extractor responses kept in SQLite across runs. Entries older than max_age_days are
+    # dropped, and the rest is trimmed to max_entries by last use, whenever the cache is flushed.
+    def __init__(self, path: str, max_entries: int = 10000, max_age_days: Optional[float] = 30):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age_days = max_age_days
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS extractions "
+                        "(key TEXT PRIMARY KEY, response TEXT NOT NULL, created REAL NOT NULL, last_used REAL NOT NULL)")
+        self.db.commit()
+
+    def get(self, key: str) -> Optional[str]:
+        row = self.db.execute("SELECT response, created FROM extractions WHERE key = ?", (key,)).fetchone()
+        if row is not None and self._expired(row[1]):
+            row = None
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.db.execute("UPDATE extractions SET last_used = ? WHERE key = ?", (time.time(), key))
+        self.db.commit()
+        return row[0]
+
+    def put(self, key: str, response: str):
+        # Committed right away: every entry stands for a model call
+        now = time.time()
+        self.db.execute("INSERT OR REPLACE INTO extractions VALUES (?, ?, ?, ?)", (key, response, now, now))
+        self.db.commit()
+
+    def flush(self):
+        if self.max_age_days is not None:
+            cursor = self.db.execute("DELETE FROM extractions WHERE created < ?",
+                                     (time.time() - self.max_age_days * 86400,))
+            self.evictions += cursor.rowcount
+        cursor = self.db.execute("DELETE FROM extractions WHERE key NOT IN "
+                                 "(SELECT key FROM extractions ORDER BY last_used DESC LIMIT ?)", (self.max_entries,))
+        self.evictions += cursor.rowcount
+        self.db.commit()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        size = self.db.execute("SELECT COUNT(*) FROM extractions").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "size": size,
+                "hit_rate": self.hits / lookups if lookups else 0.0}
+
+    def _expired(self, created: float) -> bool:
+        return self.max_age_days is not None and created < time.time() - self.max_age_days * 86400
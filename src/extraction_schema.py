@@ -0,0 +1,120 @@
+from typing import Any, Dict, List, Optional, Tuple, Type, Union
+
+from pydantic import BaseModel, ValidationError, field_validator
+
+
+def _as_list(value):
+    # A single value where the prompt asks for a list (e.g. "eats": "ia2025:Bread")
+    return [value] if isinstance(value, (str, int, float)) else value
+
+
+class Person(BaseModel):
+    id: Optional[str] = None
+    livesInCityID: Optional[str] = None
+    age: Optional[int] = None
+    isMarriedTo: Optional[str] = None
+    isAllergicTo: Optional[str] = None
+    eats: Optional[List[str]] = None
+    worksAs: Optional[str] = None
+    hasCondition: Optional[List[str]] = None
+    isReserved: Optional[bool] = None
+    talksToCount: Optional[int] = None
+
+    _lists = field_validator("eats", "hasCondition", mode="before")(_as_list)
+
+
+class City(BaseModel):
+    id: Optional[str] = None
+    type: Optional[str] = None
+    terrain: Optional[str] = None
+    population: Optional[int] = None
+    isAdjacentTo: Optional[Union[str, List[str]]] = None
+
+
+class Landmark(BaseModel):
+    id: Optional[str] = None
+    type: Optional[str] = None
+    locatedIn: Optional[List[str]] = None
+
+    _lists = field_validator("locatedIn", mode="before")(_as_list)
+
+
+class Travel(BaseModel):
+    id: Optional[str] = None
+    mode: Optional[str] = None
+    distance: Optional[float] = None
+    duration: Optional[float] = None
+    cost: Optional[float] = None
+
+
+class Climate(BaseModel):
+    id: Optional[str] = None
+    climateZone: Optional[str] = None
+    allowsForFood: Optional[bool] = None
+
+
+class Weather(BaseModel):
+    id: Optional[str] = None
+    weatherState: Optional[str] = None
+    temperature: Optional[float] = None
+
+
+class StoryData(BaseModel):
+    people: List[Person] = []
+    cities: List[City] = []
+    landmarks: List[Landmark] = []
+    climates: List[Climate] = []
+    weather: List[Weather] = []
+    travels: List[Travel] = []
+
+
+class ExtractionResponse(BaseModel):
+    # The JSON document UNIVERSAL_PROMPT_TEMPLATE asks for
+    data: StoryData
+
+
+# The JSON schema the extractor's output is constrained to (Ollama's "format" option)
+EXTRACTION_SCHEMA = ExtractionResponse.model_json_schema()
+
+CATEGORY_MODELS: Dict[str, Type[BaseModel]] = {"people": Person, "cities": City, "landmarks": Landmark,
+                                               "climates": Climate, "weather": Weather, "travels": Travel}
+
+
+def repair_entity(category: str, entity: Any) -> Tuple[Optional[dict], int]:
+    # Validates one entity; the fields that fail validation are dropped instead of the whole
+    # entity. Returns the entity (None when it is not an object) and the number of dropped fields.
+    model = CATEGORY_MODELS[category]
+    if not isinstance(entity, dict):
+        return None, 1
+    dropped = 0
+    while True:
+        try:
+            return model.model_validate(entity).model_dump(exclude_none=True), dropped
+        except ValidationError as e:
+            invalid = {error["loc"][0] for error in e.errors() if error["loc"]}
+            if not invalid & entity.keys():
+                return None, dropped + 1
+            entity = {field: value for field, value in entity.items() if field not in invalid}
+            dropped += len(invalid)
+
+
+def repair_extraction(data: Any) -> Tuple[Optional[dict], int]:
+    # Validates and repairs the "data" object of a response, entity by entity. Returns None
+    # when it is not an object at all, and the number of dropped fields and entities.
+    if not isinstance(data, dict):
+        return None, 1
+    repaired = {}
+    dropped = 0
+    for category in CATEGORY_MODELS:
+        entities = data.get(category)
+        if entities is None:
+            continue
+        if not isinstance(entities, list):
+            entities = [entities]
+        repaired[category] = []
+        for entity in entities:
+            entity, entity_dropped = repair_entity(category, entity)
+            dropped += entity_dropped
+            if entity is not None:
+                repaired[category].append(entity)
+    return repaired, dropped
@@ -0,0 +1,170 @@
+import json
+import re
+from string import hexdigits
+from typing import Any, List, Optional, Tuple
+
+WHITESPACE = " \t\n\r"
+LITERALS = ("true", "false", "null")
+NUMBER = re.compile(r"-?(0|[1-9]\d*)(\.\d+)?([eE][+-]?\d+)?")
+NUMBER_CHARS = set("0123456789+-.eE")
+STRING_ESCAPES = set('"\\/bfnrt')
+
+
+class JSONStreamError(ValueError):
+    pass
+
+
+class _Container:
+    def __init__(self, kind: str, start: int, path: Tuple[Any, ...]):
+        self.kind = kind  # "object" or "array"
+        self.start = start
+        self.path = path
+        # object: key_or_end, key, colon, value, comma_or_end; array: value_or_end, value, comma_or_end
+        self.expecting = "key_or_end" if kind == "object" else "value_or_end"
+        self.key = None
+        self.index = 0
+
+
+class ExtractionStream:
+    # Incremental JSON parser of one extractor response. feed() takes the text as the model
+    # streams it and returns the (category, object) pairs of the data.<category> lists that
+    # the new text completed. It raises JSONStreamError as soon as the text can no longer be
+    # the start of a valid JSON document, so the generation can be aborted right there.
+    def __init__(self):
+        self.text = ""
+        self.stack: List[_Container] = []
+        self.done = False
+        self.scalar: Optional[str] = None  # "string", "number" or "literal" being read
+        self.scalar_start = 0
+        self.is_key = False
+        self.escape = 0  # 1 after a backslash, 2-5 while reading the hex digits of \uXXXX
+
+    def feed(self, text: str) -> List[Tuple[str, dict]]:
+        completed = []
+        offset = len(self.text)
+        self.text += text
+        for i in range(offset, len(self.text)):
+            self._char(self.text[i], i, completed)
+        return completed
+
+    def close(self) -> str:
+        # The whole response, once it is one complete JSON document
+        if self.scalar == "number" and not self.stack:
+            self._end_number(len(self.text))
+        if not self.done:
+            raise JSONStreamError("Incomplete JSON at the end of the response")
+        return self.text
+
+    def _char(self, c: str, i: int, completed: List[Tuple[str, dict]]):
+        if self.scalar == "string":
+            self._string_char(c, i)
+            return
+        if self.scalar == "number":
+            if c in NUMBER_CHARS:
+                return
+            self._end_number(i)
+        elif self.scalar == "literal":
+            if c.isalpha():
+                if not any(literal.startswith(self.text[self.scalar_start:i + 1]) for literal in LITERALS):
+                    raise JSONStreamError(f"Invalid literal at position {self.scalar_start}")
+                return
+            if self.text[self.scalar_start:i] not in LITERALS:
+                raise JSONStreamError(f"Invalid literal at position {self.scalar_start}")
+            self.scalar = None
+            self._end_value()
+
+        if c in WHITESPACE:
+            return
+        if self.done:
+            raise JSONStreamError(f"Unexpected {c!r} after the end of the JSON document at position {i}")
+
+        top = self.stack[-1] if self.stack else None
+        expecting = top.expecting if top is not None else "value"
+        if expecting in ("value", "value_or_end"):
+            if c == "]" and expecting == "value_or_end":
+                self._close(i, completed)
+            else:
+                self._start_value(c, i, top)
+        elif expecting in ("key", "key_or_end"):
+            if c == "}" and expecting == "key_or_end":
+                self._close(i, completed)
+            elif c == '"':
+                self._start_scalar("string", i, is_key=True)
+            else:
+                raise JSONStreamError(f"Expected an object key at position {i}, got {c!r}")
+        elif expecting == "colon":
+            if c != ":":
+                raise JSONStreamError(f"Expected ':' at position {i}, got {c!r}")
+            top.expecting = "value"
+        elif c == ",":
+            if top.kind == "object":
+                top.expecting = "key"
+            else:
+                top.expecting = "value"
+                top.index += 1
+        elif c == ("}" if top.kind == "object" else "]"):
+            self._close(i, completed)
+        else:
+            raise JSONStreamError(f"Expected ',' or the end of the {top.kind} at position {i}, got {c!r}")
+
+    def _string_char(self, c: str, i: int):
+        if self.escape == 1:
+            if c == "u":
+                self.escape = 2
+            elif c in STRING_ESCAPES:
+                self.escape = 0
+            else:
+                raise JSONStreamError(f"Invalid escape at position {i}")
+        elif self.escape:
+            if c not in hexdigits:
+                raise JSONStreamError(f"Invalid \\u escape at position {i}")
+            self.escape = self.escape + 1 if self.escape < 5 else 0
+        elif c == "\\":
+            self.escape = 1
+        elif c == '"':
+            self.scalar = None
+            if self.is_key:
+                top = self.stack[-1]
+                top.key = json.loads(self.text[self.scalar_start:i + 1])
+                top.expecting = "colon"
+            else:
+                self._end_value()
+        elif ord(c) < 0x20:
+            raise JSONStreamError(f"Control character in a string at position {i}")
+
+    def _start_value(self, c: str, i: int, top: Optional[_Container]):
+        if c in "{[":
+            path = () if top is None else top.path + ((top.key if top.kind == "object" else top.index),)
+            self.stack.append(_Container("object" if c == "{" else "array", i, path))
+        elif c == '"':
+            self._start_scalar("string", i)
+        elif c == "-" or c.isdigit():
+            self._start_scalar("number", i)
+        elif c in "tfn":
+            self._start_scalar("literal", i)
+        else:
+            raise JSONStreamError(f"Expected a value at position {i}, got {c!r}")
+
+    def _start_scalar(self, kind: str, i: int, is_key: bool = False):
+        self.scalar = kind
+        self.scalar_start = i
+        self.is_key = is_key
+
+    def _end_number(self, end: int):
+        if NUMBER.fullmatch(self.text[self.scalar_start:end]) is None:
+            raise JSONStreamError(f"Invalid number at position {self.scalar_start}")
+        self.scalar = None
+        self._end_value()
+
+    def _close(self, i: int, completed: List[Tuple[str, dict]]):
+        container = self.stack.pop()
+        path = container.path
+        if container.kind == "object" and len(path) == 3 and path[0] == "data" and isinstance(path[2], int):
+            completed.append((path[1], json.loads(self.text[container.start:i + 1])))
+        self._end_value()
+
+    def _end_value(self):
+        if self.stack:
+            self.stack[-1].expecting = "comma_or_end"
+        else:
+            self.done = True
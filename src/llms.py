@@ -1,5 +1,18 @@
-from langchain_core.prompts import PromptTemplate
-from langchain_ollama import ChatOllama
+import asyncio
+from functools import lru_cache
+
+from extraction_schema import EXTRACTION_SCHEMA
+
+EXTRACTOR_MODEL = "llama3.1"
+# ChatOllama options of the extractor (output format and sampling, e.g. temperature or seed);
+# they are part of the extraction cache key. The output is constrained to the JSON schema of
+# extraction_schema.ExtractionResponse; {"format": "json"} only asks for any JSON document.
+EXTRACTOR_OPTIONS = {"format": EXTRACTION_SCHEMA}
+REWRITER_MODEL = "llama3.1"
+# ChatOllama options of the speculative rewrite candidates (see main.rewrite_candidates): the
+# first candidate is the plain rewriter, the others sample with other seeds and temperatures
+REWRITE_CANDIDATE_OPTIONS = [{}, {"seed": 1, "temperature": 0.4}, {"seed": 2, "temperature": 1.0},
+                             {"seed": 3, "temperature": 1.3}]
 
 UNIVERSAL_PROMPT_TEMPLATE = """
 You are an information extraction system.
@@ -57,27 +70,61 @@ Story to analyze:
 {story}
 """
 
-prompt_extractor = PromptTemplate(
-    template=UNIVERSAL_PROMPT_TEMPLATE,
-    input_variables=["story"]
-)
 
-print("Initialising agent")
-try:
-    llm_extractor = ChatOllama(model="llama3.1").bind(format="json")
-    llm_extractor.invoke("Hi. Return {'status':'ok'}")
-    print("LLM extractor (JSON mode) ready")
-except Exception as e:
-    print(f"ERROR: {e}")
-    exit()
+# The clients are built on first use, so importing this module (or main.py) neither loads
+# langchain_ollama, which alone takes seconds, nor needs a running model. warm_up() and
+# awarm_up() check the models explicitly and load them into memory before the first story.
+@lru_cache(maxsize=None)
+def get_prompt_extractor():
+    from langchain_core.prompts import PromptTemplate
+    return PromptTemplate(
+        template=UNIVERSAL_PROMPT_TEMPLATE,
+        input_variables=["story"]
+    )
+
+
+@lru_cache(maxsize=None)
+def get_llm_extractor():
+    from langchain_ollama import ChatOllama
+    return ChatOllama(model=EXTRACTOR_MODEL, **EXTRACTOR_OPTIONS)
+
+
+@lru_cache(maxsize=None)
+def get_llm_rewriter():
+    from langchain_ollama import ChatOllama
+    return ChatOllama(model=REWRITER_MODEL)
+
+
+@lru_cache(maxsize=None)
+def get_llm_rewriter_candidate(candidate: int):
+    if not REWRITE_CANDIDATE_OPTIONS[candidate]:
+        return get_llm_rewriter()
+    from langchain_ollama import ChatOllama
+    return ChatOllama(model=REWRITER_MODEL, **REWRITE_CANDIDATE_OPTIONS[candidate])
 
-try:
-    llm_rewriter = ChatOllama(model="llama3.1")
-    llm_rewriter.invoke("Hi")
+
+@lru_cache(maxsize=None)
+def get_chain_extractor():
+    # The raw model message is kept (instead of parsing it to a string) for its token counts
+    return get_prompt_extractor() | get_llm_extractor()
+
+
+def warm_up():
+    # Raises when a model is unavailable
+    print("Initialising agent")
+    get_llm_extractor().invoke("Hi. Return {'status':'ok'}")
+    print("LLM extractor (JSON mode) ready")
+    get_llm_rewriter().invoke("Hi")
     print("LLM rewriter ready")
-except Exception as e:
-    print(f"ERROR: {e}")
-    exit()
+
+
+async def awarm_up():
+    # Both models are asked at once
+    print("Initialising agent")
+    await asyncio.gather(get_llm_extractor().ainvoke("Hi. Return {'status':'ok'}"),
+                         get_llm_rewriter().ainvoke("Hi"))
+    print("LLM extractor (JSON mode) and rewriter ready")
+
 
 rewriting_template = lambda original_story, errors_list: f"""
 You are a story editor. Your task is to rewrite the following story ONLY to fix the logical inconsistencies listed below.
@@ -101,6 +148,34 @@ Option B (Keep 'talks to many'): "Luca, despite initial impressions, chatted wit
 Rewritten Story (English, minimal changes, choose ONE option if traits conflict, only the story text):
 """
 
+# The violations a targeted rewrite could not trace to a sentence, listed along with the story
+other_inconsistencies = lambda other_errors: f"""
+Other Inconsistencies (found somewhere in the story; change the sentences above only where they cause them):
+{other_errors}
+""" if other_errors else ""
+
+sentence_rewriting_template = lambda story, numbered_sentences, errors_list, other_errors="": f"""
+You are a story editor. The numbered sentences below, taken from the story, cause the logical inconsistencies listed below.
+Rewrite ONLY these sentences to fix the inconsistencies. Apply the ABSOLUTE MINIMAL change necessary.
+
+**Crucially, if the inconsistency involves a conflict between a described trait (like 'reserved') and a described action (like 'talks to many people'), you MUST choose EITHER the trait OR the action to keep and REMOVE the conflicting part.**
+
+Maintain the original language (English), style, and overall plot, and keep every sentence consistent with the rest of the story.
+Return every numbered sentence on its own line, as "[number] sentence". To remove a sentence, return its number followed by nothing.
+DO NOT add any commentary, explanation, or text other than the numbered sentences.
+
+Story:
+"{story}"
+
+Sentences to rewrite:
+{numbered_sentences}
+
+Detected Inconsistencies:
+{errors_list}
+{other_inconsistencies(other_errors)}
+Rewritten Sentences (English, minimal changes, one "[number] sentence" line per sentence):
+"""
+
 rewriting_template_baseline = lambda original_story: f"""
 You are a story editor. Your task is to rewrite the following story and fix logical inconsistencies listed below.
 Apply the ABSOLUTE MINIMAL change necessary.
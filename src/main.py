@@ -1,47 +1,461 @@
+import asyncio
+import contextlib
+import hashlib
+import io
 import json
+import os
+import queue
 import re
-from typing import List, Any
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+from functools import lru_cache
+from typing import List, Any, Optional
 from typing import TypedDict, Tuple
 
-from langchain_core.output_parsers import StrOutputParser
-from langgraph.graph import StateGraph, END
-
+from extraction_cache import ExtractionCache, extraction_key
+from extraction_schema import repair_entity, repair_extraction
 from facts2triples import convert_schema_to_triples
-from llms import llm_rewriter, llm_extractor, prompt_extractor, rewriting_template , rewriting_template_baseline
-from ontology_checker import OntologyChecker
+from json_stream import ExtractionStream, JSONStreamError
+from llms import (EXTRACTOR_MODEL, EXTRACTOR_OPTIONS, REWRITE_CANDIDATE_OPTIONS, UNIVERSAL_PROMPT_TEMPLATE, awarm_up,
+                  get_chain_extractor, get_llm_rewriter, get_llm_rewriter_candidate, rewriting_template,
+                  rewriting_template_baseline, sentence_rewriting_template, warm_up)
+from metrics import Metrics
+from ontology_checker import CheckState, OntologyChecker
+from rule_extraction import RuleExtraction, extract_rules, merge_rule_data
+from provenance import (Span, excerpt, fact_provenance, numbered, parse_numbered, reextraction, sentence_spans,
+                        splice, violation_spans)
 from scenarios import *
+from story_chunks import CATEGORY_PREFIXES, merge_extractions, scope_ids, split_story
 
 
 class AgentState(TypedDict):
     original_story: str
     current_story: str
     extracted_facts: List[Tuple[str, str, Any]]
+    fact_provenance: List[List[Span]]  # the sentences of extracted_story each fact was extracted from
+    extracted_story: str  # the story extracted_facts were extracted from
     inconsistencies: List[str]
+    check_state: Optional[CheckState]
+    extraction_failed: bool  # no usable extractor response, so the story was not checked
+    extraction_failures: int
     iteration_count: int
     max_iterations: int
+    # Convergence of the rewrite loop (see convergence): fingerprints of every checked story and
+    # its violation set, and why the loop stopped early, if it did
+    story_fingerprints: List[str]
+    violation_fingerprints: List[str]
+    last_rewrite: str  # "targeted" or "full"
+    rewrite_strategy: str  # "targeted" until escalated to "full"
+    cycles_detected: int
+    stalled_iterations: int  # rewrites in a row without fewer violations than best_violation_count
+    best_violation_count: Optional[int]
+    escalations: int
+    stop_reason: Optional[str]
+
+
+ONTOLOGY_PATH = "./final_version5.rdf"
+
+
+# Loaded on first use, so importing this module stays cheap (see load_agent)
+@lru_cache(maxsize=None)
+def get_checker() -> OntologyChecker:
+    return OntologyChecker(ONTOLOGY_PATH)
+
+
+@lru_cache(maxsize=None)
+def get_extraction_cache() -> Optional[ExtractionCache]:
+    return ExtractionCache(EXTRACTION_CACHE_PATH) if EXTRACTION_CACHE_PATH is not None else None
+
+
+def load_agent() -> OntologyChecker:
+    # The models are warmed up while the ontology is loaded; raises when a model is unavailable.
+    # The sync clients are used: an async warm-up would bind the async clients' connections to
+    # a loop that closes right after, and the rewrite candidates use them on candidate_loop.
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        models_ready = executor.submit(warm_up)
+        checker = get_checker()
+        models_ready.result()
+    return checker
+
+
+async def aload_agent() -> OntologyChecker:
+    # Same as load_agent, but the models are warmed up on the running event loop, which the
+    # async model clients stay bound to
+    checker, _ = await asyncio.gather(asyncio.to_thread(get_checker), awarm_up())
+    return checker
 
 
-checker = OntologyChecker("./final_version5.rdf")
+# Timings and counters of the story being run, shared with the checker (see run loop below).
+# A context variable, so that stories running concurrently in async mode each see their own.
+story_metrics: ContextVar[Metrics] = ContextVar("story_metrics", default=Metrics())
 
-chain_extractor = prompt_extractor | llm_extractor | StrOutputParser()
+# The checker is not thread-safe: in async mode (and for the rewrite candidates, see
+# candidate_loop) all checks run one at a time on this thread, off the event loop, while the
+# other stories wait for the model. The lock also covers the checks of the sync nodes.
+checker_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="checker")
+checker_lock = threading.Lock()
+
+# Extractor responses of the whole run: how many there were, how many could not be parsed at
+# all and how many were repaired (see extraction_schema), reported at the end of the run
+extraction_stats = Counter()
+
+
+def invoke_timed(node: str, runnable, prompt):
+    start = time.perf_counter()
+    response = runnable.invoke(prompt)
+    story_metrics.get().add_llm_call(node, time.perf_counter() - start, response)
+    return response
+
+
+async def ainvoke_timed(node: str, runnable, prompt):
+    start = time.perf_counter()
+    response = await runnable.ainvoke(prompt)
+    story_metrics.get().add_llm_call(node, time.perf_counter() - start, response)
+    return response
 
 
 def extract_facts(state: AgentState) -> dict:
     print(f"\n--- NODE: Fact extraction (Interation {state['iteration_count']})")
+    story, reused, scope = extraction_plan(state)
+    rules = rule_extraction(story)
+    chunks, keys, responses = cached_extractions(story, rules)
+    missing = [i for i, response in enumerate(responses) if response is None]
+    early = EarlyCheck(len(chunks), state.get("check_state"), story_metrics.get(), reused, rules.data, scope)
+    if missing and STREAM_EXTRACTION:
+        fresh = stream_chunks(chunks, missing, early)
+    elif missing:
+        # A single missing chunk (any short story) is one plain call
+        fresh = [response_text(response) for response in
+                 batch_timed("extract", get_chain_extractor(), [{"story": chunks[i]} for i in missing])]
+    else:
+        fresh = []
+    for i, response_string in zip(missing, fresh):
+        responses[i] = response_string
+    return extraction_result(state, facts_from_responses(responses, keys, missing, rules.data, scope), early, reused)
+
+
+async def aextract_facts(state: AgentState) -> dict:
+    print(f"\n--- NODE: Fact extraction (Interation {state['iteration_count']})")
+    story, reused, scope = extraction_plan(state)
+    rules = rule_extraction(story)
+    chunks, keys, responses = cached_extractions(story, rules)
+    missing = [i for i, response in enumerate(responses) if response is None]
+    early = EarlyCheck(len(chunks), state.get("check_state"), story_metrics.get(), reused, rules.data, scope)
+    if STREAM_EXTRACTION:
+        fresh = await asyncio.gather(*(astream_extraction(chunks[i], early.receiver(i, early.check_soon), early.metrics)
+                                       for i in missing))
+        await early.settle()
+    else:
+        fresh = [response_text(response) for response in await asyncio.gather(
+            *(ainvoke_timed("extract", get_chain_extractor(), {"story": chunks[i]}) for i in missing),
+            return_exceptions=True)]
+    for i, response_string in zip(missing, fresh):
+        responses[i] = response_string
+    return extraction_result(state, facts_from_responses(responses, keys, missing, rules.data, scope), early, reused)
+
+
+def extraction_plan(state: AgentState) -> Tuple[str, List[Tuple[str, str, Any]], Optional[str]]:
+    # The text to send to the extractor, the facts reused from the previous extraction and the
+    # scope of the IDs of the records extracted again (see story_data). After a rewrite only
+    # the new and edited sentences, and those of the facts that cannot be kept, are extracted
+    # again (with the sentence before each, see provenance.excerpt).
+    story, previous = state["current_story"], state.get("extracted_story", "")
+    facts = state.get("extracted_facts", [])
+    if not INCREMENTAL_EXTRACTION or not previous or not facts:
+        return story, [], None
+    changed, reused = reextraction(previous, story, facts)
+    sentence_count = len(sentence_spans(story))
+    if len(changed) > sentence_count * INCREMENTAL_EXTRACTION_MAX_SHARE:
+        return story, [], None
+    metrics = story_metrics.get()
+    metrics.add_count("reextracted_sentences", len(changed))
+    metrics.add_count("reused_facts", len(reused))
+    print(f"Extracting {len(changed)} of {sentence_count} sentences again, reusing {len(reused)} facts.")
+    return excerpt(story, changed), reused, f"r{state['iteration_count']}"
+
+
+def merge_facts(reused: List[Tuple[str, str, Any]], facts: List[Tuple[str, str, Any]]) -> List[Tuple[str, str, Any]]:
+    known = set(reused)
+    return reused + [fact for fact in facts if fact not in known]
+
+
+def extraction_result(state: AgentState, result: dict, early: "EarlyCheck", reused: list) -> dict:
+    result["check_state"] = early.state
+    if result["extraction_failed"]:
+        # Extracted again from scratch: the facts of the failed iteration are unknown
+        result.update(fact_provenance=[], extracted_story="",
+                      extraction_failures=state.get("extraction_failures", 0) + 1)
+        return result
+    result["extracted_facts"] = merge_facts(reused, result["extracted_facts"])
+    result["extracted_story"] = state["current_story"]
+    with story_metrics.get().phase("provenance"):
+        result["fact_provenance"] = fact_provenance(state["current_story"], result["extracted_facts"])
+    return result
+
+
+class StreamedResponse:
+    # One extractor response read as the model streams it: the message chunks are added up
+    # (for the token counts) and the text is parsed incrementally (see json_stream)
+    def __init__(self, metrics: Metrics):
+        self.metrics = metrics
+        self.parser = ExtractionStream()
+        self.response = None
+        self.entities = 0
+        self.start = time.perf_counter()
+
+    def receive(self, message) -> List[Tuple[str, dict]]:
+        self.response = message if self.response is None else self.response + message
+        entities = self.parser.feed(message.content)
+        if entities and not self.entities:
+            self.metrics.add_time("llm:extract:first_entity", time.perf_counter() - self.start)
+        self.entities += len(entities)
+        return entities
+
+    def finish(self) -> str:
+        text = self.parser.close()
+        self.metrics.add_llm_call("extract", time.perf_counter() - self.start, self.response)
+        return text
+
+    def failed(self, error: Exception) -> None:
+        if isinstance(error, JSONStreamError):
+            print(f"Received:\n{self.parser.text}")
+            print(f"Extraction aborted: {error}")
+            self.metrics.add_count("extraction_aborted", 1)
+            self.metrics.add_count("extraction_parse_failure", 1)
+            extraction_stats["responses"] += 1
+            extraction_stats["parse_failures"] += 1
+        else:
+            print(f"Error: {error}")
+        return None
+
+
+def stream_extraction(chunk: str, on_entity, metrics: Metrics) -> Optional[str]:
+    # The response text, or None when it failed. Every data entity is passed to on_entity as
+    # soon as its object closes, and closing the stream at the first invalid JSON stops the
+    # generation there.
+    streamed = StreamedResponse(metrics)
+    stream = get_chain_extractor().stream({"story": chunk})
     try:
-        response_string = chain_extractor.invoke({"story": state['current_story']})
-        data_root = json.loads(response_string)
-        if 'data' not in data_root:
-            return {"extracted_facts": []}
-        triples = convert_schema_to_triples(data_root['data'])
+        for message in stream:
+            for category, entity in streamed.receive(message):
+                on_entity(category, entity)
+        return streamed.finish()
+    except Exception as e:
+        return streamed.failed(e)
+    finally:
+        stream.close()
+
+
+async def astream_extraction(chunk: str, on_entity, metrics: Metrics) -> Optional[str]:
+    streamed = StreamedResponse(metrics)
+    stream = get_chain_extractor().astream({"story": chunk})
+    try:
+        async for message in stream:
+            for category, entity in streamed.receive(message):
+                on_entity(category, entity)
+        return streamed.finish()
+    except Exception as e:
+        return streamed.failed(e)
+    finally:
+        await stream.aclose()
+
+
+def stream_chunks(chunks: List[str], missing: List[int], early: "EarlyCheck") -> List[Optional[str]]:
+    # The chunks are streamed on worker threads; this thread checks their entities as they arrive
+    arrivals = queue.Queue()
+
+    def stream(i: int) -> Optional[str]:
+        try:
+            return stream_extraction(chunks[i], early.receiver(i, lambda: arrivals.put(True)), early.metrics)
+        finally:
+            arrivals.put(None)
+
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_CHUNKS) as executor:
+        futures = [executor.submit(stream, i) for i in missing]
+        finished = 0
+        while finished < len(futures):
+            if arrivals.get() is None:
+                finished += 1
+            elif arrivals.empty():
+                # Caught up with the streams: one check covers everything received so far
+                early.check()
+    return [future.result() for future in futures]
+
+
+class EarlyCheck:
+    # Checks the entities streamed so far while the extractor is still generating, starting
+    # from the previous check of the story. The check node then diffs the final facts against
+    # this state, so it only reasons about what the last entities added.
+    def __init__(self, chunk_count: int, previous: Optional[CheckState], metrics: Metrics,
+                 reused: List[Tuple[str, str, Any]] = (), rule_data: Optional[dict] = None,
+                 scope: Optional[str] = None):
+        # Every category list exists up front: in async mode the checker thread reads these
+        # dicts while the event loop appends to them
+        self.chunk_data = [{category: [] for category in CATEGORY_PREFIXES} for _ in range(chunk_count)]
+        self.state = previous
+        self.metrics = metrics
+        # The facts kept from the previous extraction, checked along with the streamed ones
+        self.reused = list(reused)
+        self.rule_data = rule_data or {}
+        self.scope = scope
+        self.checked_facts = None
+        self.pending = None
+
+    def receiver(self, chunk: int, on_added):
+        def receive(category: str, entity: dict):
+            if category in CATEGORY_PREFIXES:
+                entity, _ = repair_entity(category, entity)
+                if entity is not None:
+                    self.chunk_data[chunk][category].append(entity)
+                    on_added()
+        return receive
+
+    def check(self):
+        chunk_data = [{category: list(entities) for category, entities in data.items()} for data in self.chunk_data]
+        chunk_data = [data for data in chunk_data if any(data.values())]
+        if not chunk_data:
+            return
+        # Partial output the converter or checker cannot handle (e.g. an ID without a prefix)
+        # only costs the early check: the check node reports it for the final facts
+        try:
+            data = story_data(chunk_data, self.rule_data, self.scope)
+            # The converter's debug output is printed once, for the final facts
+            with contextlib.redirect_stdout(io.StringIO()):
+                facts = merge_facts(self.reused, convert_schema_to_triples(data))
+            if facts and facts != self.checked_facts:
+                self.checked_facts = facts
+                _, self.state = check_facts(facts, self.state, self.metrics, "early_check")
+        except Exception as e:
+            print(f"Skipped the early check: {e}")
+            self.metrics.add_count("early_check_errors", 1)
+
+    def check_soon(self):
+        # Async mode: one check at a time on the checker thread; the entities that arrive
+        # while it runs are picked up by the next one (or by the check node)
+        if self.pending is None or self.pending.done():
+            self.pending = asyncio.get_running_loop().run_in_executor(checker_executor, self.check)
+
+    async def settle(self):
+        if self.pending is not None:
+            await self.pending
+
+
+def response_text(response) -> Optional[str]:
+    # None for a failed call: the chunk is left out
+    if isinstance(response, Exception):
+        print(f"Error: {response}")
+        return None
+    return response.content
+
+
+def batch_timed(node: str, runnable, prompts: list) -> list:
+    # Runs the prompts concurrently; every call is recorded with the time of the whole batch
+    start = time.perf_counter()
+    responses = runnable.batch(prompts, config={"max_concurrency": MAX_CONCURRENT_CHUNKS}, return_exceptions=True)
+    elapsed = time.perf_counter() - start
+    for response in responses:
+        if not isinstance(response, Exception):
+            story_metrics.get().add_llm_call(node, elapsed, response)
+    return responses
+
+
+def rule_extraction(story: str) -> RuleExtraction:
+    # The facts the patterns of rule_extraction read off the story before the extractor runs.
+    # The extractor is skipped when they leave no sentence uncovered.
+    metrics = story_metrics.get()
+    with metrics.phase("rule_extraction"):
+        rules = extract_rules(story)
+    metrics.add_count("rule_sentences", rules.sentences)
+    metrics.add_count("rule_covered_sentences", rules.covered)
+    if rules.complete:
+        skipped = len(split_story(story))
+        metrics.add_count("extraction_skipped_calls", skipped)
+        extraction_stats["skipped_calls"] += skipped
+        print(f"Rule extraction covered all {rules.sentences} sentences: the extractor is skipped.")
+    elif rules.covered:
+        print(f"Rule extraction covered {rules.covered} of {rules.sentences} sentences.")
+    return rules
+
+
+def count_extraction_time(kind: str, name: str, value: float):
+    # Metrics callback: run totals of the extractor calls, to estimate what skipped ones cost
+    if kind == "time" and name == "llm:extract":
+        extraction_stats["calls"] += 1
+        extraction_stats["seconds"] += value
+
+
+def cached_extractions(story: str, rules: RuleExtraction) -> Tuple[List[str], List[str], List[Optional[str]]]:
+    # Long stories are extracted in chunks (see story_chunks); each chunk's response is
+    # cached across runs by its text, the model, the options and the prompt
+    # Nothing to extract when a rewrite only removed sentences (see extraction_plan) or the
+    # patterns covered the whole story
+    chunks = split_story(story) if story.strip() and not rules.complete else []
+    story_metrics.get().add_count("extraction_chunks", len(chunks))
+    keys = [extraction_key(chunk, EXTRACTOR_MODEL, EXTRACTOR_OPTIONS, UNIVERSAL_PROMPT_TEMPLATE) for chunk in chunks]
+    cache = get_extraction_cache()
+    if cache is None:
+        return chunks, keys, [None] * len(chunks)
+    responses = [cache.get(key) for key in keys]
+    for response in responses:
+        story_metrics.get().add_count("extraction_cache_hit", int(response is not None))
+    return chunks, keys, responses
+
+
+def story_data(chunk_data: List[dict], rule_data: Optional[dict] = None, scope: Optional[str] = None) -> dict:
+    # One "data" object for the chunks of a story (a single chunk goes through unchanged), with
+    # the pattern values filled in. The records of an excerpt extracted after a rewrite are
+    # numbered from 1 again, so with a scope their IDs are kept apart from the reused ones.
+    data = merge_rule_data(rule_data or {}, chunk_data[0] if len(chunk_data) == 1 else merge_extractions(chunk_data))
+    return scope_ids(data, scope) if scope else data
+
+
+def facts_from_responses(responses: List[Optional[str]], keys: List[str], fresh: List[int],
+                         rule_data: Optional[dict] = None, scope: Optional[str] = None) -> dict:
+    chunk_data = [data_from_response(response, keys[i] if i in fresh else None)
+                  for i, response in enumerate(responses) if response is not None]
+    chunk_data = [data for data in chunk_data if data is not None]
+    if responses and not chunk_data:
+        return {"extracted_facts": [], "extraction_failed": True}
+    metrics = story_metrics.get()
+    try:
+        data = story_data(chunk_data, rule_data, scope)
+        with metrics.phase("facts_to_triples"):
+            triples = convert_schema_to_triples(data)
+        metrics.add_count("extracted_triples", len(triples))
         print(f"Generated {len(triples)} triples.")
-        return {"extracted_facts": triples}
-    except json.JSONDecodeError as e:
-        print(f"Received:\n{response_string}")
-        return {"extracted_facts": []}
+        return {"extracted_facts": triples, "extraction_failed": False}
     except Exception as e:
         print(f"Error: {e}")
-        return {"extracted_facts": []}
+        return {"extracted_facts": [], "extraction_failed": True}
+
+
+def data_from_response(response_string: str, cache_key: Optional[str] = None) -> Optional[dict]:
+    # The validated "data" object of a response (see extraction_schema): invalid fields and
+    # entities are dropped instead of the whole response. A fresh response is cached under
+    # cache_key once it parses, so a malformed one is retried on the next run.
+    metrics = story_metrics.get()
+    extraction_stats["responses"] += 1
+    try:
+        data_root = json.loads(response_string)
+        data, dropped = repair_extraction(data_root.get('data') if isinstance(data_root, dict) else None)
+    except json.JSONDecodeError as e:
+        print(f"Received:\n{response_string}")
+        data, dropped = None, 0
+    metrics.add_count("extraction_parse_failure", int(data is None))
+    if data is None:
+        extraction_stats["parse_failures"] += 1
+        return None
+    if dropped:
+        print(f"Repaired the extractor response: dropped {dropped} invalid fields or entities.")
+        extraction_stats["repaired"] += 1
+    metrics.add_count("extraction_dropped_fields", dropped)
+    cache = get_extraction_cache()
+    if cache is not None and cache_key is not None:
+        cache.put(cache_key, response_string)
+    return data
 
 
 def query_ontology(state: AgentState) -> dict:
@@ -50,72 +464,422 @@ def query_ontology(state: AgentState) -> dict:
     if not facts:
         return {"inconsistencies": []}
     print(facts)
-    violations = checker.check_consistency(facts)
-    return {"inconsistencies": violations}
+    violations, check_state = check_facts(facts, state.get("check_state"), story_metrics.get())
+    return {"inconsistencies": violations, "check_state": check_state, **convergence(state, violations)}
+
+
+async def aquery_ontology(state: AgentState) -> dict:
+    print("--- NODE: Ontology and reasoning")
+    facts = state["extracted_facts"]
+    if not facts:
+        return {"inconsistencies": []}
+    print(facts)
+    violations, check_state = await asyncio.get_running_loop().run_in_executor(
+        checker_executor, check_facts, facts, state.get("check_state"), story_metrics.get())
+    return {"inconsistencies": violations, "check_state": check_state, **convergence(state, violations)}
+
+
+def convergence(state: AgentState, violations: List[str]) -> dict:
+    # Tracks whether the rewrites are getting anywhere. A story checked before means the
+    # rewriter went back to an earlier version (a cycle); a violation count not below the best
+    # so far for MAX_STALLED_ITERATIONS rewrites in a row means it stalled. Either escalates
+    # targeted rewrites to full ones, or else stops the loop.
+    story = fingerprint(" ".join(state["current_story"].split()))
+    violation_set = fingerprint("\n".join(sorted(set(violations))))
+    stories, violation_sets = state.get("story_fingerprints", []), state.get("violation_fingerprints", [])
+    best = state.get("best_violation_count")
+    update = {"story_fingerprints": stories + [story], "violation_fingerprints": violation_sets + [violation_set],
+              "best_violation_count": len(violations) if best is None else min(best, len(violations))}
+    if not violations or best is None:
+        # Nothing to fix, or the first check of the story
+        return update
+    cycle = story in stories
+    stalled = 0 if len(violations) < best else state.get("stalled_iterations", 0) + 1
+    update["stalled_iterations"] = stalled
+    if not cycle and stalled < MAX_STALLED_ITERATIONS:
+        return update
+
+    metrics = story_metrics.get()
+    if cycle:
+        reason = "the rewrite repeats an earlier version of the story"
+        update["cycles_detected"] = state.get("cycles_detected", 0) + 1
+        metrics.add_count("rewrite_cycle", 1)
+    elif violation_set == violation_sets[-1]:
+        reason = f"the violations did not change in {stalled} rewrites"
+    else:
+        reason = f"no fewer violations in {stalled} rewrites"
+    if state.get("last_rewrite") == "targeted":
+        print(f"Convergence: {reason}. Escalating to full rewrites.")
+        update.update(rewrite_strategy="full", stalled_iterations=0, escalations=state.get("escalations", 0) + 1)
+        metrics.add_count("rewrite_escalation", 1)
+    else:
+        update["stop_reason"] = reason
+    return update
+
+
+def fingerprint(text: str) -> str:
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+def check_facts(facts: List[Tuple[str, str, Any]], previous: Optional[CheckState], metrics: Metrics,
+                phase: str = "check") -> Tuple[List[str], CheckState]:
+    checker = get_checker()
+    with checker_lock:
+        checker.metrics = metrics
+        # Diffed against the previous iteration's check where that is faster than a full check
+        # (large layers, small edits), so only the rewritten facts are reasoned about again
+        with metrics.phase(phase):
+            return checker.check_consistency_incremental(facts, previous)
 
 
 def rewrite_story(state: AgentState) -> dict:
     print("--- NODE: Fixing issues and rewriting ---")
+    return rewrite_with(state, get_llm_rewriter())
+
+
+async def arewrite_story(state: AgentState) -> dict:
+    print("--- NODE: Fixing issues and rewriting ---")
+    return await arewrite_with(state, get_llm_rewriter())
+
+
+def rewrite_with(state: AgentState, rewriter) -> dict:
+    plan = rewrite_targets(state)
+    if plan is not None:
+        targets, context = plan
+        response = invoke_timed("rewrite_sentences", rewriter, sentence_rewrite_prompt(state, targets, context))
+        new_story = spliced_story(state, targets, response.content)
+        if new_story is not None:
+            return rewritten_state(state, new_story, "targeted")
+    response = invoke_timed("rewrite", rewriter, rewrite_prompt(state))
+    return rewritten_state(state, clean_rewritten_story(response.content), "full")
+
+
+async def arewrite_with(state: AgentState, rewriter) -> dict:
+    plan = rewrite_targets(state)
+    if plan is not None:
+        targets, context = plan
+        response = await ainvoke_timed("rewrite_sentences", rewriter, sentence_rewrite_prompt(state, targets, context))
+        new_story = spliced_story(state, targets, response.content)
+        if new_story is not None:
+            return rewritten_state(state, new_story, "targeted")
+    response = await ainvoke_timed("rewrite", rewriter, rewrite_prompt(state))
+    return rewritten_state(state, clean_rewritten_story(response.content), "full")
+
+
+def rewrite_candidates(state: AgentState) -> dict:
+    # Speculative mode: REWRITE_CANDIDATES rewrites (see llms.REWRITE_CANDIDATE_OPTIONS) are
+    # each extracted and checked concurrently. The first consistent one wins right away and
+    # the others are cancelled; otherwise the one with the fewest violations wins. The state
+    # returned has been checked already. In sync mode the candidates run as tasks on
+    # candidate_loop, since tasks, unlike threads, can be cancelled.
+    metrics = story_metrics.get()
+
+    async def run() -> dict:
+        story_metrics.set(metrics)
+        return await arewrite_candidates(state)
+
+    return asyncio.run_coroutine_threadsafe(run(), candidate_loop()).result()
+
+
+async def arewrite_candidates(state: AgentState) -> dict:
+    print(f"--- NODE: Fixing issues and rewriting ({REWRITE_CANDIDATES} candidates) ---")
+    tasks = [asyncio.create_task(achecked_candidate(state, candidate)) for candidate in range(REWRITE_CANDIDATES)]
+    best = None
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            try:
+                result = await next_done
+            except Exception as e:
+                print(f"Error in a rewrite candidate: {e}")
+                result = e
+            best = better_candidate(best, result)
+            if candidate_score(best) == (False, 0):
+                break
+    finally:
+        # The remaining candidates' model calls are cancelled. A check already running on the
+        # checker thread still finishes there, but nothing waits for it.
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    return chosen_candidate(best)
+
+
+@lru_cache(maxsize=None)
+def candidate_loop() -> asyncio.AbstractEventLoop:
+    # The event loop of the sync mode's rewrite candidates, running for the whole process on a
+    # daemon thread: the async model clients stay bound to the loop they were first used on
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name="candidates", daemon=True).start()
+    return loop
+
+
+async def achecked_candidate(state: AgentState, candidate: int) -> Tuple[int, dict]:
+    candidate_state = {**state, **await arewrite_with(state, get_llm_rewriter_candidate(candidate))}
+    candidate_state.update(await aextract_facts(candidate_state))
+    candidate_state.update(await aquery_ontology(candidate_state))
+    return candidate, candidate_state
 
+
+def candidate_score(candidate) -> Tuple[bool, float]:
+    # Lower is better: a checked story first, then the fewest violations
+    if candidate is None or isinstance(candidate, Exception):
+        return True, float("inf")
+    _, candidate_state = candidate
+    return candidate_state["extraction_failed"], len(candidate_state["inconsistencies"])
+
+
+def better_candidate(best, candidate):
+    # The candidate that finished first wins a tie
+    return candidate if candidate_score(candidate) < candidate_score(best) else best
+
+
+def chosen_candidate(best) -> dict:
+    if best is None or isinstance(best, Exception):
+        raise RuntimeError("Every rewrite candidate failed") from best
+    candidate, candidate_state = best
+    metrics = story_metrics.get()
+    metrics.add_count("rewrite_candidate_chosen", candidate)
+    metrics.add_count("rewrite_candidate_violations", len(candidate_state["inconsistencies"]))
+    print(f"Chose rewrite candidate {candidate} with {len(candidate_state['inconsistencies'])} violations.")
+    return candidate_state
+
+
+def rewrite_prompt(state: AgentState) -> str:
     errors_list = "\n".join(state["inconsistencies"])
     original_story = state["original_story"]
+    return rewriting_template(original_story, errors_list)
 
-    prompt_template = rewriting_template(original_story, errors_list)
 
-    response = llm_rewriter.invoke(prompt_template)
-    new_story = response.content.strip()
+def rewrite_targets(state: AgentState) -> Optional[Tuple[List[Span], List[str]]]:
+    # The sentences of current_story behind the violations (see provenance), up to
+    # TARGETED_REWRITE_MAX_SHARE of the story, and the violations left out: those traced to no
+    # sentence or to too many more, which the prompt only lists along with the story (a later
+    # iteration targets them). None when the whole story is rewritten instead: a short story,
+    # no violation traced to few enough sentences, and once the loop escalated to full rewrites.
+    story = state["current_story"]
+    sentence_count = len(sentence_spans(story))
+    if state.get("rewrite_strategy") == "full" or sentence_count < TARGETED_REWRITE_MIN_SENTENCES:
+        return None
+    facts, provenance = state["extracted_facts"], state.get("fact_provenance", [])
+    if len(provenance) != len(facts):
+        return None
+    targets, context = set(), []
+    for violation in state["inconsistencies"]:
+        spans = violation_spans(violation, facts, provenance, get_checker().rule_reads)
+        if spans and len(targets | spans) <= sentence_count * TARGETED_REWRITE_MAX_SHARE:
+            targets |= spans
+        else:
+            context.append(violation)
+    if not targets:
+        return None
+    if context:
+        print(f"{len(context)} of {len(state['inconsistencies'])} violations are sent with the story as context only.")
+    return sorted(targets), context
+
+
+def sentence_rewrite_prompt(state: AgentState, targets: List[Span], context: List[str]) -> str:
+    errors_list = "\n".join(violation for violation in state["inconsistencies"] if violation not in context)
+    story = state["current_story"]
+    return sentence_rewriting_template(story, numbered(story, targets), errors_list, "\n".join(context))
+
+
+def spliced_story(state: AgentState, targets: List[Span], response_content: str) -> Optional[str]:
+    # current_story with the rewritten sentences put in place, or None when the response does
+    # not have one line per sentence
+    sentences = parse_numbered(response_content, len(targets))
+    metrics = story_metrics.get()
+    metrics.add_count("targeted_rewrite", int(sentences is not None))
+    if sentences is None:
+        print("Targeted rewrite failed: the response does not list every sentence. Rewriting the whole story.")
+        return None
+    print(f"Rewrote {len(targets)} of {len(sentence_spans(state['current_story']))} sentences.")
+    return splice(state["current_story"], dict(zip(targets, sentences)))
 
-    if new_story.startswith("Rewritten Story:"): new_story = new_story.replace("Rewritten Story:", "").strip()
-    if new_story.startswith("Here is the rewritten story:"): new_story = new_story.replace(
-        "Here is the rewritten story:", "").strip()
-    new_story = re.sub(r'\s*\([^)]*\)$', '', new_story).strip()
 
+def rewritten_state(state: AgentState, new_story: str, strategy: str) -> dict:
     print(f"Rewrited history:\n{new_story}")
 
     return {
         "current_story": new_story,
         "iteration_count": state["iteration_count"] + 1,
-        "inconsistencies": []
+        "inconsistencies": [],
+        "last_rewrite": strategy
     }
 
-def rewrite_story_baseline(original_story) -> str:
-    prompt_template = rewriting_template_baseline(original_story)
 
-    response = llm_rewriter.invoke(prompt_template)
-    new_story = response.content.strip()
+def clean_rewritten_story(response_content: str) -> str:
+    new_story = response_content.strip()
 
     if new_story.startswith("Rewritten Story:"): new_story = new_story.replace("Rewritten Story:", "").strip()
     if new_story.startswith("Here is the rewritten story:"): new_story = new_story.replace(
         "Here is the rewritten story:", "").strip()
-    new_story = re.sub(r'\s*\([^)]*\)$', '', new_story).strip()
+    return re.sub(r'\s*\([^)]*\)$', '', new_story).strip()
+
+
+def rewrite_story_baseline(original_story) -> str:
+    prompt_template = rewriting_template_baseline(original_story)
+
+    response = invoke_timed("rewrite_baseline", get_llm_rewriter(), prompt_template)
+    new_story = clean_rewritten_story(response.content)
 
     print(f"Rewrited story:\n{new_story}")
     return new_story
 
+
+async def arewrite_story_baseline(original_story) -> str:
+    prompt_template = rewriting_template_baseline(original_story)
+
+    response = await ainvoke_timed("rewrite_baseline", get_llm_rewriter(), prompt_template)
+    new_story = clean_rewritten_story(response.content)
+
+    print(f"Rewrited story:\n{new_story}")
+    return new_story
+
+
 def decide_next_step(state: AgentState) -> str:
     print("--- NODE: Checking violoaitons (decision) ---")
+    if state.get("extraction_failed"):
+        # An empty fact set is not a consistent story: extract again (the failed response was not cached)
+        if state["extraction_failures"] > MAX_EXTRACTION_RETRIES:
+            print("Decision: Extraction failed. Ended without a check."); return "end"
+        print("Decision: Extraction failed. Extracting again."); return "extract"
     if not state["inconsistencies"]:
         print("Decision: No violences. Ended");
         return "end"
+    if state.get("stop_reason"):
+        print(f"Decision: Not converging ({state['stop_reason']}). Ended."); return "end"
     if state["iteration_count"] >= state["max_iterations"]: print(
         f"Decision: Interation range error ({state['max_iterations']}). Ended."); return "end"
     print(f"Decision: Found {len(state['inconsistencies'])} violations. Rewriting.")
     return "rewrite"
 
 
-def create_agent_state():
+def create_agent_state(async_mode: bool = False):
+    # Imported here: langgraph takes seconds to import and only the agent needs it
+    from langgraph.graph import StateGraph, END
+
+    if not 1 <= REWRITE_CANDIDATES <= len(REWRITE_CANDIDATE_OPTIONS):
+        raise ValueError(f"REWRITE_CANDIDATES is {REWRITE_CANDIDATES}, expected 1 to "
+                         f"{len(REWRITE_CANDIDATE_OPTIONS)} (one per llms.REWRITE_CANDIDATE_OPTIONS entry).")
     workflow = StateGraph(AgentState)
-    workflow.add_node("extract", extract_facts)
-    workflow.add_node("check", query_ontology)
-    workflow.add_node("rewrite", rewrite_story)
+    workflow.add_node("extract", aextract_facts if async_mode else extract_facts)
+    workflow.add_node("check", aquery_ontology if async_mode else query_ontology)
+    speculative = REWRITE_CANDIDATES > 1
+    if speculative:
+        workflow.add_node("rewrite", arewrite_candidates if async_mode else rewrite_candidates)
+    else:
+        workflow.add_node("rewrite", arewrite_story if async_mode else rewrite_story)
     workflow.set_entry_point("extract")
     workflow.add_edge("extract", "check")
-    workflow.add_conditional_edges("check", decide_next_step, {"end": END, "rewrite": "rewrite"})
-    workflow.add_edge("rewrite", "extract")
+    next_steps = {"end": END, "rewrite": "rewrite", "extract": "extract"}
+    workflow.add_conditional_edges("check", decide_next_step, next_steps)
+    if speculative:
+        # The chosen candidate was extracted and checked already
+        workflow.add_conditional_edges("rewrite", decide_next_step, next_steps)
+    else:
+        workflow.add_edge("rewrite", "extract")
     app = workflow.compile()
     return app
 
 
+def initial_state(story_text: str) -> AgentState:
+    return {"original_story": story_text, "current_story": story_text, "extracted_facts": [], "fact_provenance": [],
+            "extracted_story": "", "inconsistencies": [], "check_state": None, "extraction_failed": False,
+            "extraction_failures": 0, "iteration_count": 1, "max_iterations": 6, "story_fingerprints": [],
+            "violation_fingerprints": [], "last_rewrite": "", "rewrite_strategy": "targeted", "cycles_detected": 0,
+            "stalled_iterations": 0, "best_violation_count": None, "escalations": 0, "stop_reason": None}
+
+
+def run_story(app, name: str, story_text: str):
+    story_metrics.set(Metrics(name, trace_memory=TRACE_MEMORY, callback=count_extraction_time))
+    # agent + onthology mode
+    if AGENT_MODE:
+        print(f"=== Run AGENT FOR: {name} ===")
+        final_state_snapshot = {}
+        for event in app.stream(initial_state(story_text), stream_mode="values"):
+            final_state_snapshot = event
+        report_story(name, final_state_snapshot)
+        report_rule_extraction()
+    # baseline mode
+    else:
+        rewrite_story_baseline(story_text)
+    dump_metrics(name)
+
+
+async def arun_story(app, name: str, story_text: str, limit: asyncio.Semaphore):
+    # Runs in its own task, so the metrics set here are only seen by this story's nodes
+    async with limit:
+        story_metrics.set(Metrics(name, trace_memory=TRACE_MEMORY, callback=count_extraction_time))
+        if AGENT_MODE:
+            print(f"=== Run AGENT FOR: {name} ===")
+            final_state_snapshot = {}
+            async for event in app.astream(initial_state(story_text), stream_mode="values"):
+                final_state_snapshot = event
+            report_story(name, final_state_snapshot)
+            report_rule_extraction()
+        else:
+            await arewrite_story_baseline(story_text)
+        dump_metrics(name)
+
+
+async def arun_stories(stories: dict, max_concurrent: int):
+    try:
+        await aload_agent()
+    except Exception as e:
+        print(f"ERROR: {e}")
+        exit()
+    app = create_agent_state(async_mode=True)
+    limit = asyncio.Semaphore(max_concurrent)
+    await asyncio.gather(*(arun_story(app, name, story_text, limit) for name, story_text in stories.items()))
+
+
+def report_story(name: str, final_state_snapshot: dict):
+    if final_state_snapshot:
+        print(f"Original story ({name}):\n{final_state_snapshot.get('original_story', 'NO DATA')}")
+        final_inconsistencies = final_state_snapshot.get('inconsistencies', [])
+        iterations = final_state_snapshot.get('iteration_count', 1) - 1
+        print("--- FINAL STORY ---")
+        print(
+            f"Final story (after {iterations} iterations of rewriting):\n{final_state_snapshot.get('current_story', 'NO DATA')}")
+        if final_state_snapshot.get('extraction_failed'):
+            print("\nStory not checked: the extraction failed.")
+        elif not final_inconsistencies:
+            print("\nStory succed.")
+        else:
+            print("\nStory failed. Found the following inconsistencies:")
+            for inconsistency in final_inconsistencies:
+                print(f"  - {inconsistency}")
+        if final_state_snapshot.get('stop_reason'):
+            print(f"Stopped early: {final_state_snapshot['stop_reason']}.")
+        print(f"Checked versions: {len(final_state_snapshot.get('story_fingerprints', []))}, "
+              f"distinct: {len(set(final_state_snapshot.get('story_fingerprints', [])))}, "
+              f"cycles: {final_state_snapshot.get('cycles_detected', 0)}, "
+              f"escalations: {final_state_snapshot.get('escalations', 0)}")
+    else:
+        print(f"\nERROR: No state for {name}.")
+
+
+def report_rule_extraction():
+    # Sentences the patterns covered over all iterations, and the extractor time they saved,
+    # estimated from the mean extractor call of the run so far
+    counts = story_metrics.get().counts
+    sentences = sum(counts.get("rule_sentences", []))
+    if not sentences:
+        return
+    covered = sum(counts["rule_covered_sentences"])
+    skipped = sum(counts.get("extraction_skipped_calls", []))
+    report = f"Rule extraction: {covered} of {sentences} sentences covered, {skipped} extractor calls skipped"
+    if skipped and extraction_stats["calls"]:
+        report += f" (about {skipped * extraction_stats['seconds'] / extraction_stats['calls']:.1f} s saved)"
+    print(report)
+
+
+def dump_metrics(name: str):
+    if METRICS_DIR is not None:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        story_metrics.get().dump(os.path.join(METRICS_DIR, f"{name}.json"))
+
+
 stories_to_run = {
     "LARGE_STORY_4": LARGE_STORY_4
 }
@@ -141,33 +905,68 @@ stories_to_run = {
 # note that the baseline does utilize a similar rewriting instruction prompt as the agent mode
 AGENT_MODE = True
 
+# true runs up to MAX_CONCURRENT_STORIES stories at once with the async model clients; the
+# speedup is bounded by how many requests the model server serves in parallel (for Ollama,
+# OLLAMA_NUM_PARALLEL)
+ASYNC_MODE = False
+MAX_CONCURRENT_STORIES = 4
+# Chunks of a long story extracted at once in sync mode (in async mode they all are)
+MAX_CONCURRENT_CHUNKS = 4
+# true parses the extractor output as it is generated: the entities are checked while the
+# rest is still generating, and invalid JSON stops the generation right away
+STREAM_EXTRACTION = True
+# Extractions retried per story when no response is usable
+MAX_EXTRACTION_RETRIES = 2
+# After a rewrite only the new and edited sentences are extracted again, unless they are more
+# than this share of the story
+INCREMENTAL_EXTRACTION = True
+INCREMENTAL_EXTRACTION_MAX_SHARE = 0.5
+# Rewrites in a row without fewer violations before the loop escalates from targeted to full
+# rewrites, or stops (see convergence); a rewrite repeating an earlier story does so at once
+MAX_STALLED_ITERATIONS = 2
+# More than 1 rewrites the story this many ways at once each iteration (at most
+# len(llms.REWRITE_CANDIDATE_OPTIONS)), extracting and checking every candidate concurrently
+# and keeping the first consistent one, or else the one with the fewest violations. It takes
+# fewer rounds for more model calls, so it pays off when the model server serves requests in
+# parallel (for Ollama, OLLAMA_NUM_PARALLEL).
+REWRITE_CANDIDATES = 1
+# Violations are fixed by rewriting only the sentences they were extracted from (see
+# provenance) in stories of at least this many sentences, unless those are more than this
+# share of the story; otherwise the whole original story is rewritten
+TARGETED_REWRITE_MIN_SENTENCES = 4
+TARGETED_REWRITE_MAX_SHARE = 0.5
+
+# Per-story timings and counters are written here as <story>.json (None turns it off);
+# TRACE_MEMORY adds the peak memory of every check, at a large cost in check time
+METRICS_DIR = "./metrics"
+TRACE_MEMORY = False
+
+# Extractor responses are reused across runs from this SQLite file (None turns it off), so
+# changing only the queries rechecks the stories without calling the extractor again
+EXTRACTION_CACHE_PATH = "./extraction_cache.sqlite"
+
 if __name__ == "__main__":
-    app = create_agent_state()
-    for name, story_text in stories_to_run.items():
-        # agent + onthology mode
-        if AGENT_MODE:
-            print(f"=== Run AGENT FOR: {name} ===")
-            inputs = {"original_story": story_text, "current_story": story_text, "extracted_facts": [],
-                    "inconsistencies": [], "iteration_count": 1, "max_iterations": 6}
-            final_state_snapshot = {}
-            for event in app.stream(inputs, stream_mode="values"):
-                final_state_snapshot = event
-            if final_state_snapshot:
-                print(f"Original story:\n{final_state_snapshot.get('original_story', 'NO DATA')}")
-                final_inconsistencies = final_state_snapshot.get('inconsistencies', [])
-                iterations = final_state_snapshot.get('iteration_count', 1) - 1
-                print("--- FINAL STORY ---")
-                print(
-                    f"Final story (after {iterations} iterations of rewriting):\n{final_state_snapshot.get('current_story', 'NO DATA')}")
-                if not final_inconsistencies:
-                    print("\nStory succed.")
-                else:
-                    print("\nStory failed. Found the following inconsistencies:")
-                    for inconsistency in final_inconsistencies:
-                        print(f"  - {inconsistency}")
-            else:
-                print(f"\nERROR: No state for {name}.")
-        # baseline mode
-        else:
-            rewrite_story_baseline(story_text)
+    if ASYNC_MODE:
+        asyncio.run(arun_stories(stories_to_run, MAX_CONCURRENT_STORIES))
+    else:
+        try:
+            load_agent()
+        except Exception as e:
+            print(f"ERROR: {e}")
+            exit()
+        app = create_agent_state()
+        for name, story_text in stories_to_run.items():
+            run_story(app, name, story_text)
 
+    extraction_cache = get_extraction_cache()
+    if extraction_cache is not None:
+        extraction_cache.flush()
+        print(f"Extraction cache: {extraction_cache.stats()}")
+    if extraction_stats["responses"]:
+        print(f"Extractor responses: {extraction_stats['responses']}, unparseable: {extraction_stats['parse_failures']} "
+              f"({extraction_stats['parse_failures'] / extraction_stats['responses']:.1%}), "
+              f"repaired: {extraction_stats['repaired']}")
+    if extraction_stats["skipped_calls"]:
+        saved = (f", about {extraction_stats['skipped_calls'] * extraction_stats['seconds'] / extraction_stats['calls']:.1f} s"
+                 if extraction_stats["calls"] else "")
+        print(f"Extractor calls skipped by rule extraction: {extraction_stats['skipped_calls']}{saved}")
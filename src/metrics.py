@@ -0,0 +1,81 @@
+import json
+import time
+import tracemalloc
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+
+# Called with (kind, name, value) for every recorded timing ("time", seconds) and count ("count", value)
+MetricsCallback = Callable[[str, str, float], None]
+
+
+class Metrics:
+    # Structured timings and counters of one story run. Every phase can run many times (one per
+    # rewrite iteration or per rule), so each name keeps the list of its values, which is what
+    # latency histograms across a batch run are built from.
+    def __init__(self, story: Optional[str] = None, trace_memory: bool = False,
+                 callback: Optional[MetricsCallback] = None):
+        self.story = story
+        # tracemalloc slows allocation-heavy code down several times, so it is opt-in
+        self.trace_memory = trace_memory
+        self.callback = callback
+        self.timings: Dict[str, List[float]] = defaultdict(list)
+        self.counts: Dict[str, List[float]] = defaultdict(list)
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    @contextmanager
+    def peak_memory(self, name: str):
+        # Records the peak of traced allocations while the block runs, in bytes
+        if not self.trace_memory:
+            yield
+            return
+        started = not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        try:
+            yield
+        finally:
+            self.add_count(name, tracemalloc.get_traced_memory()[1])
+            if started:
+                tracemalloc.stop()
+
+    def add_time(self, name: str, seconds: float):
+        self.timings[name].append(seconds)
+        if self.callback is not None:
+            self.callback("time", name, seconds)
+
+    def add_count(self, name: str, value: float):
+        self.counts[name].append(value)
+        if self.callback is not None:
+            self.callback("count", name, value)
+
+    def add_llm_call(self, node: str, seconds: float, response):
+        # Latency and token counts of a chat model response (langchain AIMessage)
+        self.add_time(f"llm:{node}", seconds)
+        usage = getattr(response, "usage_metadata", None) or {}
+        for key in ("input_tokens", "output_tokens"):
+            if key in usage:
+                self.add_count(f"llm:{node}:{key}", usage[key])
+
+    def summary(self) -> Dict[str, dict]:
+        summary = {}
+        for name, values in self.timings.items():
+            summary[name] = {"calls": len(values), "total_ms": sum(values) * 1000,
+                             "mean_ms": sum(values) / len(values) * 1000, "max_ms": max(values) * 1000}
+        return summary
+
+    def to_dict(self) -> dict:
+        return {"story": self.story, "timings": dict(self.timings), "counts": dict(self.counts),
+                "summary": self.summary()}
+
+    def dump(self, path: str):
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
@@ -0,0 +1,36 @@
+from typing import Iterable, Optional, Set
+
+from rdflib import Graph
+from rdflib.namespace import RDF, RDFS
+
+from delta_reasoner import DeltaRDFSReasoner
+from rule_requirements import Requirement
+from triple_store import TermDictionary, interned_graph
+
+# Reads that only the axiomatic RDFS consequences can satisfy (see DeltaRDFSReasoner.axiomatic_rules)
+AXIOMATIC_READS = {
+    (RDF.type, None), (RDF.type, RDFS.Resource), (RDF.type, RDF.Property), (RDF.type, RDFS.Class),
+    (RDF.type, RDFS.Datatype), (RDF.type, RDFS.ContainerMembershipProperty), (RDF.type, RDFS.Literal),
+    (RDFS.subClassOf, None), (RDFS.subPropertyOf, None),
+}
+
+
+def needs_axiomatic_rules(rule_reads: Iterable[Optional[Set[Requirement]]]) -> bool:
+    return any(reads is None or reads & AXIOMATIC_READS for reads in rule_reads)
+
+
+class MinimalRDFSReasoner(DeltaRDFSReasoner):
+    # Materializes only what the consistency rules read: domain and range types, subclass and
+    # subproperty inheritance and the transitivity of both, plus owlrl's same-value literal
+    # copies (which add violation rows). The axiomatic triples, which make up most of an
+    # owlrl RDFS closure, are derived only when a rule reads them. The base closure is
+    # computed by the same delta rules instead of owlrl.
+    def __init__(self, base_graph: Graph, axiomatic_rules: bool = False, terms: Optional[TermDictionary] = None):
+        self.axiomatic_rules = axiomatic_rules
+        super().__init__(base_graph, terms=terms)
+
+    def _materialize(self, base_graph: Graph) -> Graph:
+        # The whole ontology is a delta over an empty base closure
+        self.closure_graph = interned_graph(self.terms)
+        self._base_triples = lambda pattern: ()
+        return self._derive(self.seed(base_graph))
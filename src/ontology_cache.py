@@ -0,0 +1,75 @@
+import hashlib
+import os
+import pickle
+from typing import Optional, Tuple
+
+from owlrl import DeductiveClosure, RDFS_Semantics
+from rdflib import Graph
+
+# Bump when the snapshot layout or the way the closure is computed changes
+SNAPSHOT_VERSION = 1
+
+
+def load_ontology(ontology_path: str, cache_dir: Optional[str] = None) -> Tuple[Graph, Graph]:
+    # Returns the parsed ontology and its RDFS closure. With a cache_dir both are stored in a
+    # pickle snapshot keyed by the content hash of the RDF file, so later starts skip the
+    # RDF/XML parser and the reasoner; editing the file simply produces a new key.
+    snapshot_path = None
+    if cache_dir is not None:
+        digest = ontology_digest(ontology_path)
+        name = os.path.splitext(os.path.basename(ontology_path))[0]
+        snapshot_path = os.path.join(cache_dir, f"{name}.v{SNAPSHOT_VERSION}.{digest}.pickle")
+
+        if os.path.exists(snapshot_path):
+            try:
+                with open(snapshot_path, "rb") as f:
+                    base_triples, inferred_triples = pickle.load(f)
+                base_graph = _graph_from(base_triples)
+                closure_graph = _graph_from(base_triples)
+                closure_graph.addN((s, p, o, closure_graph) for s, p, o in inferred_triples)
+                print(f"Loaded ontology snapshot {snapshot_path}")
+                return base_graph, closure_graph
+            except Exception as e:
+                print(f"Ignoring unreadable ontology snapshot {snapshot_path}: {e}")
+
+    base_graph = Graph()
+    base_graph.parse(ontology_path, format="xml")
+    closure_graph = Graph()
+    closure_graph += base_graph
+    DeductiveClosure(RDFS_Semantics).expand(closure_graph)
+
+    if snapshot_path is not None:
+        _write_snapshot(snapshot_path, base_graph, closure_graph)
+    return base_graph, closure_graph
+
+
+def ontology_digest(ontology_path: str) -> str:
+    with open(ontology_path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()[:16]
+
+
+def _graph_from(triples) -> Graph:
+    g = Graph()
+    g.addN((s, p, o, g) for s, p, o in triples)
+    return g
+
+
+def _write_snapshot(snapshot_path: str, base_graph: Graph, closure_graph: Graph):
+    cache_dir = os.path.dirname(snapshot_path)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        # Snapshots of older versions of the same ontology are never read again
+        prefix = os.path.basename(snapshot_path).rsplit(".", 2)[0]
+        for old in os.listdir(cache_dir):
+            if old.startswith(prefix + ".") and old.endswith(".pickle"):
+                os.remove(os.path.join(cache_dir, old))
+
+        base_triples = list(base_graph)
+        inferred_triples = [t for t in closure_graph if t not in base_graph]
+        tmp_path = f"{snapshot_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump((base_triples, inferred_triples), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, snapshot_path)
+        print(f"Wrote ontology snapshot {snapshot_path}")
+    except OSError as e:
+        print(f"Could not write ontology snapshot {snapshot_path}: {e}")
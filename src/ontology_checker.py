@@ -1,14 +1,82 @@
-from typing import List, Tuple, Any
+import gc
+import multiprocessing
+import os
+import time
+from contextlib import nullcontext
+from functools import lru_cache
+from typing import Dict, FrozenSet, List, NamedTuple, Optional, Set, Tuple, Any
 
-from owlrl import DeductiveClosure, RDFS_Semantics
 from rdflib import Graph, Literal, URIRef, Namespace
+from rdflib.graph import ReadOnlyGraphAggregate
 from rdflib.namespace import RDF, RDFS, XSD, OWL
+from rdflib.plugins.sparql import prepareQuery
 
+from constraint_engine import NATIVE_RULES, TripleIndex
+from delta_reasoner import DeltaRDFSReasoner
+from metrics import Metrics
+from minimal_reasoner import MinimalRDFSReasoner, needs_axiomatic_rules
+from ontology_cache import load_ontology, ontology_digest
+from ontology_module import ModuleExtractor, Signature
 from queries import ALL_QUERIES
+from result_cache import CheckResult, CheckResultCache, fact_set_key, version_digest
+from rule_requirements import derive_reads, derive_requirements, present_terms
+from triple_store import TermDictionary, interned_graph
+
+REASONER_BACKENDS = ("owlrl", "minimal")
+
+RESOLVED_URI_CACHE_SIZE = 4096
+
+# check_consistency_incremental diffs against the previous check only when its story layer has
+# at least this many triples and at most this share of the seed triples changed
+INCREMENTAL_MIN_LAYER = 32
+INCREMENTAL_MAX_CHANGE_SHARE = 0.2
+
+# Checker used by pool workers: inherited from the parent when the pool is forked,
+# built from the ontology snapshot in the worker otherwise
+_worker_checker = None
+
+
+def _init_worker(ontology_path: str, use_native_rules: bool, cache_dir: Optional[str], use_modules: bool,
+                 reasoner_backend: str):
+    global _worker_checker
+    if _worker_checker is None:
+        _worker_checker = OntologyChecker(ontology_path, use_native_rules, cache_dir, use_modules=use_modules,
+                                          reasoner_backend=reasoner_backend)
+
+
+def _check_chunk(fact_sets: List[List[Tuple[str, str, Any]]]) -> List[CheckResult]:
+    return _worker_checker._check_graphs([_worker_checker._facts_graph(facts) for facts in fact_sets])
+
+
+class ReasoningBase(NamedTuple):
+    # A closed ontology (the whole one or a module of it) that story layers are reasoned over
+    reasoner: DeltaRDFSReasoner
+    index: TripleIndex
+    terms: Set[Tuple[Any, Any]]  # predicates and classes present, see rule_requirements
+
+
+class StoryLayer(NamedTuple):
+    base: ReasoningBase
+    graph: Graph  # facts and inferences not already in the base closure
+    index: Optional[TripleIndex]
+    view: ReadOnlyGraphAggregate
+
+
+class CheckState(NamedTuple):
+    # What check_consistency_incremental keeps of one check to diff the next one against
+    facts: FrozenSet[Tuple[Any, Any, Any]]
+    base: ReasoningBase
+    seed: Set[Tuple[Any, Any, Any]]
+    graph: Graph  # story layer (facts and inferences not in the base closure)
+    rule_violations: Dict[str, List[str]]
+    skipped_rules: List[str]
 
 
 class OntologyChecker:
-    def __init__(self, ontology_path: str):
+    def __init__(self, ontology_path: str, use_native_rules: bool = True,
+                 cache_dir: Optional[str] = ".ontology_cache", result_cache_size: int = 1024,
+                 result_cache_path: Optional[str] = None, metrics: Optional[Metrics] = None,
+                 use_modules: bool = False, module_cache_size: int = 128, reasoner_backend: str = "owlrl"):
         self.namespaces = {
             "demo": Namespace("http://www.semanticweb.org/alexandrosxanthopoulos/ontologies/2025/9/ProjectDemo#"),
             "ia2025": Namespace("http://example.org/ia2025#"),
@@ -21,30 +89,274 @@ class OntologyChecker:
             "xsd": XSD
         }
 
-        self.base_graph = Graph()
-        self.base_graph.parse(ontology_path, format="xml")
+        self.ontology_path = ontology_path
+        self.cache_dir = cache_dir
+        # Optional structured timings and counters of every check (see metrics.Metrics)
+        self.metrics = metrics
+
+        # cache_dir=None always parses the RDF/XML file and recomputes the closure
+        start = time.perf_counter()
+        self.base_graph, closure_graph = load_ontology(ontology_path, cache_dir)
+        self.ontology_load_time = time.perf_counter() - start
 
         for prefix, namespace in self.namespaces.items():
             self.base_graph.bind(prefix, namespace)
 
-        self.queries = ALL_QUERIES
-        print(f"Loaded ontology and {len(self.queries)} queries.")
+        # Rules with a native implementation are evaluated over hash indexes, the rest with SPARQL
+        self.use_native_rules = use_native_rules
+
+        # Parsing and algebra translation happen once here instead of on every check
+        start = time.perf_counter()
+        self.queries = {name: prepareQuery(query_string) for name, query_string in ALL_QUERIES.items()}
+        self.query_compile_time = time.perf_counter() - start
+        self.query_execution_time = 0.0
+
+        # A rule is skipped when a predicate or class it needs occurs neither in the ontology
+        # closure nor in the story layer, since it cannot return any row then
+        self.rule_requirements = {name: derive_requirements(query) for name, query in self.queries.items()}
+        # Predicates and classes each rule reads (None: anything), to find the rules an edit touches
+        self.rule_reads = {name: derive_reads(query) for name, query in self.queries.items()}
+        self.skipped_rules = []
+        self.batch_skipped_rules = []
+
+        # "owlrl" reproduces owlrl's RDFS closure, "minimal" only derives what the rules read
+        if reasoner_backend not in REASONER_BACKENDS:
+            raise ValueError(f"Unknown reasoner backend: '{reasoner_backend}'. Expected one of {REASONER_BACKENDS}.")
+        self.reasoner_backend = reasoner_backend
+        # Every term is interned once: the closures store integer IDs from this dictionary, and
+        # the fact graphs and story layers of each story from an overlay of it, so the terms of
+        # a story are dropped along with its graphs
+        self.terms = TermDictionary()
+        # The same entity and property names come back in every story and rewrite iteration.
+        # The cache is bounded, so it never pins more than that many names.
+        self._resolve_uri = lru_cache(maxsize=RESOLVED_URI_CACHE_SIZE)(self._resolve_uri)
+        start = time.perf_counter()
+        self.reasoner = self._new_reasoner(self.base_graph, closure_graph)
+        self.base_closure_time = time.perf_counter() - start
+        self.base_index = TripleIndex(self.reasoner.closure_graph)
+        self.base_terms = present_terms(self.reasoner.closure_graph)
+        self.full_base = ReasoningBase(self.reasoner, self.base_index, self.base_terms)
+        print(f"Base closure materialized ({reasoner_backend}): "
+              f"{len(self.base_graph)} -> {len(self.reasoner.closure_graph)} triples.")
+
+        # With use_modules each fact set is reasoned over the module of the ontology reachable
+        # from its terms, closed on its own, instead of over the whole closure. The modules and
+        # their closures are cached per signature.
+        self.use_modules = use_modules
+        self.module_extractor = ModuleExtractor(self.base_graph)
+        self._module_base = lru_cache(maxsize=module_cache_size)(self._build_module_base)
+
+        # Identical fact sets (common across rewrite iterations) reuse the earlier result. The
+        # key includes the ontology and query set, so editing either never hits stale results.
+        self.result_cache = None
+        if result_cache_size > 0:
+            self.result_cache = CheckResultCache(result_cache_size, result_cache_path)
+        self.result_version = version_digest([ontology_digest(ontology_path)] +
+                                             [f"{name}\n{query}" for name, query in ALL_QUERIES.items()])
+        print(f"Loaded ontology and {len(self.queries)} queries (compiled in {self.query_compile_time * 1000:.1f} ms).")
 
     def check_consistency(self, extracted_facts: List[Tuple[str, str, Any]]) -> List[str]:
-        temp_graph = Graph()
-        temp_graph += self.base_graph
+        with self._peak_memory():
+            facts_graph = self._facts_graph(extracted_facts)
+            key = fact_set_key(self.result_version, facts_graph) if self.result_cache is not None else None
+            result = self.result_cache.get(key) if key is not None else None
+            if result is not None:
+                print("Reused the cached check result.")
+            else:
+                result = self._check_graph(facts_graph)
+                if key is not None:
+                    self.result_cache.put(key, result)
+                    self.result_cache.flush()
+            self.skipped_rules = result[1]
+            return self._finish([result])[0]
+
+    def check_consistency_incremental(self, extracted_facts: List[Tuple[str, str, Any]],
+                                      previous: Optional[CheckState] = None) -> Tuple[List[str], CheckState]:
+        # Rechecks a fact set against the state of an earlier check (e.g. the previous rewrite
+        # iteration): only the inferences of added and removed facts are retracted or derived,
+        # and only the rules reading a changed predicate or class run again. The violations are
+        # the same as those of check_consistency. A cached fact set is not checked at all, and
+        # small layers and large edits are checked in full, which is faster for them (see
+        # _diffable and benchmark_incremental).
+        with self._peak_memory():
+            # The story's overlay is kept across its rewrite iterations
+            facts_graph = self._facts_graph(extracted_facts, previous.graph.store.terms if previous else None)
+            facts = frozenset(facts_graph)
+            if previous is not None and previous.facts == facts:
+                print("Facts unchanged since the previous check.")
+                self.skipped_rules = list(previous.skipped_rules)
+                return self._finish_incremental(previous)
+
+            key = fact_set_key(self.result_version, facts_graph) if self.result_cache is not None else None
+            result = self.result_cache.get(key) if key is not None else None
+            if result is not None:
+                print("Reused the cached check result.")
+                self.skipped_rules = result[1]
+                # The previous state stays a valid starting point for the next check
+                return self._finish([result])[0], previous
+
+            base = self._base_for(facts_graph)
+            print("Start of reasoner")
+            with self._phase("closure"):
+                seed = base.reasoner.seed(facts_graph)
+                changed_terms = None
+                if self._diffable(previous, base, seed):
+                    story_graph, changed = base.reasoner.update(seed, previous.seed, previous.graph)
+                    if changed is not None:
+                        changed_terms = present_terms(changed)
+                else:
+                    story_graph = base.reasoner.expand(facts_graph, seed)
+            print(f"Stop reasoning. Derived {len(story_graph)} new triples.")
+
+            layer = self._layer(base, story_graph)
+            self._count_reasoning(facts_graph, layer)
+            self.skipped_rules = self._rules_that_cannot_fire(layer)
+            rule_violations = {}
+            rerun = []
+            start = time.perf_counter()
+            for query_name, query in self.queries.items():
+                reads = self.rule_reads[query_name]
+                if query_name in self.skipped_rules:
+                    rule_violations[query_name] = []
+                elif changed_terms is not None and reads is not None and not reads & changed_terms:
+                    rule_violations[query_name] = previous.rule_violations[query_name]
+                else:
+                    rule_violations[query_name] = self._rule_violations(query_name, query, layer)
+                    rerun.append(query_name)
+            self.query_execution_time = time.perf_counter() - start
+            print(f"Run {len(rerun)} of {len(self.queries)} queries in {self.query_execution_time * 1000:.1f} ms"
+                  f" ({len(self.skipped_rules)} cannot fire, the rest are unaffected by the changed facts).")
+            return self._finish_incremental(CheckState(facts, base, seed, story_graph, rule_violations,
+                                                       self.skipped_rules), key)
+
+    def _diffable(self, previous: Optional[CheckState], base: ReasoningBase, seed: Set[Tuple[Any, Any, Any]]) -> bool:
+        # Diffing only pays off over a layer large enough and an edit small enough: copying and
+        # retracting from the previous layer costs more than deriving a small one from scratch
+        if previous is None or previous.base is not base or len(previous.graph) < INCREMENTAL_MIN_LAYER:
+            return False
+        return len(seed ^ previous.seed) <= len(previous.seed) * INCREMENTAL_MAX_CHANGE_SHARE
+
+    def _finish_incremental(self, state: CheckState, key: Optional[str] = None) -> Tuple[List[str], CheckState]:
+        violations = [violation for query_name in self.queries for violation in state.rule_violations[query_name]]
+        if key is not None:
+            self.result_cache.put(key, (violations, self.skipped_rules))
+            self.result_cache.flush()
+        self._finish([(violations, self.skipped_rules)])
+        return violations, state
+
+    def check_consistency_batch(self, fact_sets: List[List[Tuple[str, str, Any]]]) -> List[List[str]]:
+        # Convenience over a loop of check_consistency calls, not a faster path: each story is
+        # reasoned and checked in its own layer over the shared base closure, exactly as a
+        # single check is, and nothing else is shared between the stories (see benchmark_batch).
+        # The violations are returned per story in input order.
+        with self._peak_memory():
+            facts_graphs = [self._facts_graph(facts) for facts in fact_sets]
+            results, missing = self._cached_results(facts_graphs)
+            if missing:
+                computed = self._check_graphs([facts_graphs[i] for i in missing])
+                self._store_results(facts_graphs, results, missing, computed)
+            return self._finish(results)
 
-        self._add_facts_to_graph(temp_graph, extracted_facts)
+    def check_consistency_parallel(self, fact_sets: List[List[Tuple[str, str, Any]]],
+                                   workers: Optional[int] = None) -> List[List[str]]:
+        # Spreads the fact sets over a process pool, since reasoning and rule evaluation are
+        # CPU-bound and hold the GIL. Forked workers share this checker's parsed and closed
+        # ontology copy-on-write instead of loading it again.
+        global _worker_checker
+        facts_graphs = [self._facts_graph(facts) for facts in fact_sets]
+        results, missing = self._cached_results(facts_graphs)
+        workers = min(workers or os.cpu_count() or 1, len(missing))
+        if workers <= 1:
+            if missing:
+                computed = self._check_graphs([facts_graphs[i] for i in missing])
+                self._store_results(facts_graphs, results, missing, computed)
+            return self._finish(results)
 
+        # A few chunks per worker keeps them busy when stories differ in size
+        pending = [fact_sets[i] for i in missing]
+        chunk_size = max(1, -(-len(pending) // (workers * 4)))
+        chunks = [pending[i:i + chunk_size] for i in range(0, len(pending), chunk_size)]
+
+        if "fork" in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context("fork")
+            # Keep the garbage collector from touching (and so copying) the inherited ontology pages
+            gc.freeze()
+            _worker_checker = self
+        else:
+            context = multiprocessing.get_context()
+
+        try:
+            with context.Pool(workers, initializer=_init_worker,
+                              initargs=(self.ontology_path, self.use_native_rules, self.cache_dir, self.use_modules,
+                                        self.reasoner_backend)) as pool:
+                chunk_results = pool.map(_check_chunk, chunks)
+        finally:
+            _worker_checker = None
+            gc.unfreeze()
+        computed = [result for chunk in chunk_results for result in chunk]
+        self._store_results(facts_graphs, results, missing, computed)
+        return self._finish(results)
+
+    def _cached_results(self, facts_graphs: List[Graph]) -> Tuple[List[Optional[CheckResult]], List[int]]:
+        results = [None] * len(facts_graphs)
+        if self.result_cache is not None:
+            for i, facts_graph in enumerate(facts_graphs):
+                results[i] = self.result_cache.get(fact_set_key(self.result_version, facts_graph))
+        missing = [i for i, result in enumerate(results) if result is None]
+        if len(missing) < len(results):
+            print(f"Reused {len(results) - len(missing)} cached check results.")
+        return results, missing
+
+    def _store_results(self, facts_graphs: List[Graph], results: List[Optional[CheckResult]], missing: List[int],
+                       computed: List[CheckResult]):
+        for i, result in zip(missing, computed):
+            results[i] = result
+            if self.result_cache is not None:
+                self.result_cache.put(fact_set_key(self.result_version, facts_graphs[i]), result)
+        if self.result_cache is not None:
+            self.result_cache.flush()
+
+    def _finish(self, results: List[CheckResult]) -> List[List[str]]:
+        self.batch_skipped_rules = [skipped for _, skipped in results]
+        for violations, _ in results:
+            self._count("violations", len(violations))
+        found = sum(len(violations) for violations, _ in results)
+        if not found:
+            print("Not found any violations.")
+        else:
+            print(f"Found {found} violations.")
+        return [violations for violations, _ in results]
+
+    def _check_graphs(self, facts_graphs: List[Graph]) -> List[CheckResult]:
+        return [self._check_graph(facts_graph) for facts_graph in facts_graphs]
+
+    def _check_graph(self, facts_graph: Graph) -> CheckResult:
         print("Start of reasoner")
-        DeductiveClosure(RDFS_Semantics).expand(temp_graph)
-        print("Stop reasoning.")
+        layer = self._story_layer(facts_graph)
+        print(f"Stop reasoning. Derived {len(layer.graph)} new triples.")
+
+        skipped = self._rules_that_cannot_fire(layer)
+        print(f"Run {len(self.queries) - len(skipped)} of {len(self.queries)} queries, skipped the ones that "
+              f"cannot fire" + (f": {', '.join(skipped)}" if skipped else ""))
 
         violations = []
-        print(f"Run {len(self.queries)} queries")
-        for query_name, query_string in self.queries.items():
+        start = time.perf_counter()
+        for query_name, query in self.queries.items():
+            if query_name not in skipped:
+                violations.extend(self._rule_violations(query_name, query, layer))
+        self.query_execution_time = time.perf_counter() - start
+        print(f"Queries executed in {self.query_execution_time * 1000:.1f} ms.")
+        return violations, skipped
+
+    def _rule_violations(self, query_name: str, query, layer: StoryLayer) -> List[str]:
+        native_rule = NATIVE_RULES.get(query_name) if self.use_native_rules else None
+        violations = []
+        with self._phase(f"query:{query_name}"):
             try:
-                results = temp_graph.query(query_string)
+                if native_rule is not None:
+                    results = native_rule(layer.index)
+                else:
+                    results = layer.view.query(query)
 
                 if len(results) > 0:
                     for row in results:
@@ -52,13 +364,70 @@ class OntologyChecker:
                         violations.append(violation_message)
             except Exception as e:
                 print(f"Error during query: '{query_name}': {e}")
-
-        if not violations:
-            print("Not found any violations.")
-        else:
-            print(f"Found {len(violations)} violations.")
         return violations
 
+    def _facts_graph(self, extracted_facts: List[Tuple[str, str, Any]],
+                     terms: Optional[TermDictionary] = None) -> Graph:
+        with self._phase("fact_insertion"):
+            facts_graph = interned_graph(terms if terms is not None else TermDictionary(self.terms))
+            self._add_facts_to_graph(facts_graph, extracted_facts)
+        return facts_graph
+
+    def _story_layer(self, facts_graph: Graph) -> StoryLayer:
+        base = self._base_for(facts_graph)
+        with self._phase("closure"):
+            story_graph = base.reasoner.expand(facts_graph)
+        layer = self._layer(base, story_graph)
+        self._count_reasoning(facts_graph, layer)
+        return layer
+
+    def _layer(self, base: ReasoningBase, story_graph: Graph) -> StoryLayer:
+        # The shared base closure is never copied or modified: the queries read the union of
+        # the base layer and the small per-story layer of facts and their inferences.
+        with self._phase("story_layer"):
+            view = ReadOnlyGraphAggregate([base.reasoner.closure_graph, story_graph])
+            index = TripleIndex(story_graph, parent=base.index) if self.use_native_rules else None
+        return StoryLayer(base, story_graph, index, view)
+
+    def _base_for(self, facts_graph: Graph) -> ReasoningBase:
+        if not self.use_modules:
+            return self.full_base
+        return self._module_base(self.module_extractor.signature(facts_graph))
+
+    def _build_module_base(self, signature: Signature) -> ReasoningBase:
+        with self._phase("module_extraction"):
+            module = self.module_extractor.extract(signature)
+        with self._phase("module_closure"):
+            reasoner = self._new_reasoner(module)
+        self._count("module_triples", len(module))
+        return ReasoningBase(reasoner, TripleIndex(reasoner.closure_graph), present_terms(reasoner.closure_graph))
+
+    def _new_reasoner(self, graph: Graph, closure_graph: Optional[Graph] = None) -> DeltaRDFSReasoner:
+        if self.reasoner_backend == "minimal":
+            return MinimalRDFSReasoner(graph, needs_axiomatic_rules(self.rule_reads.values()), self.terms)
+        return DeltaRDFSReasoner(graph, closure_graph, self.terms)
+
+    def _count_reasoning(self, facts_graph: Graph, layer: StoryLayer):
+        # Sizes of the (module) closure plus facts before reasoning, and of the full closure after it
+        base_size = len(layer.base.reasoner.closure_graph)
+        self._count("triples_before_reasoning", base_size + len(facts_graph))
+        self._count("triples_after_reasoning", base_size + len(layer.graph))
+
+    def _phase(self, name: str):
+        return self.metrics.phase(name) if self.metrics is not None else nullcontext()
+
+    def _peak_memory(self):
+        return self.metrics.peak_memory("check_peak_memory_bytes") if self.metrics is not None else nullcontext()
+
+    def _count(self, name: str, value: float):
+        if self.metrics is not None:
+            self.metrics.add_count(name, value)
+
+    def _rules_that_cannot_fire(self, layer: StoryLayer) -> List[str]:
+        story_terms = present_terms(layer.graph)
+        return [name for name, requirements in self.rule_requirements.items()
+                if any(term not in layer.base.terms and term not in story_terms for term in requirements)]
+
     def _add_facts_to_graph(self, g: Graph, facts: List[Tuple[str, str, Any]]):
         for s_str, p_str, o_val in facts:
             try:
@@ -0,0 +1,62 @@
+from collections import defaultdict
+from typing import Any, FrozenSet, Tuple
+
+from owlrl import RDFS_Semantics
+from rdflib import Graph, Literal, URIRef
+
+# The IRIs and the literals of the ontology a fact set touches (see ModuleExtractor.signature)
+Signature = Tuple[FrozenSet[URIRef], FrozenSet[Literal]]
+
+
+class ModuleExtractor:
+    # Extracts the module of the ontology relevant to a signature: every triple about a term
+    # reachable from the signature, following the objects and predicates of those triples
+    # (superclasses, superproperties, domains, ranges, disjoint classes, types and property
+    # values). Blank nodes (OWL restrictions and lists) are kept but not followed, since the
+    # RDFS rules never reason through them. The triples with a literal of the signature (one of
+    # the same value as a fact literal) are added too, because owlrl copies them onto the fact
+    # literal.
+    def __init__(self, base_graph: Graph):
+        self.about = defaultdict(list)
+        self.with_literal = defaultdict(list)
+        for s, p, o in base_graph:
+            self.about[s].append((s, p, o))
+            if isinstance(o, Literal):
+                self.with_literal[o].append((s, p, o))
+
+    def signature(self, facts_graph: Graph) -> Signature:
+        # Only the IRIs the ontology says something about and the ontology's literals of the
+        # same value as a fact literal shape the module, so fact sets about different people
+        # with the same occupations, types and properties share one module (and its closure)
+        iris, fact_literals = set(), set()
+        for triple in facts_graph:
+            for term in triple:
+                if isinstance(term, URIRef) and term in self.about:
+                    iris.add(term)
+                elif isinstance(term, Literal):
+                    fact_literals.add(term)
+        literals = {literal for literal in self.with_literal
+                    if any(RDFS_Semantics._literals_same_as(fact_literal, literal) for fact_literal in fact_literals)}
+        return frozenset(iris), frozenset(literals)
+
+    def extract(self, signature: Signature) -> Graph:
+        iris, literals = signature
+        module = Graph()
+        reached = set(iris)
+        pending = list(iris)
+
+        def add(triple: Tuple[Any, Any, Any], *terms):
+            module.add(triple)
+            for term in terms:
+                if isinstance(term, URIRef) and term not in reached:
+                    reached.add(term)
+                    pending.append(term)
+
+        for literal in literals:
+            for s, p, o in self.with_literal[literal]:
+                add((s, p, o), s, p)
+
+        while pending:
+            for s, p, o in self.about.get(pending.pop(), ()):
+                add((s, p, o), p, o)
+        return module
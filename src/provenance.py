@@ -0,0 +1,238 @@
+import re
+from difflib import SequenceMatcher
+from typing import Any, Dict, List, Optional, Pattern, Sequence, Set, Tuple
+
+from story_chunks import OVERLAP_SENTENCES, SENTENCE_END
+
+# Character offsets (start, end) of a sentence in the story
+Span = Tuple[int, int]
+Fact = Tuple[str, str, Any]
+
+CAMEL_WORDS = re.compile(r"[A-Z]?[a-z]+|[A-Z]+(?![a-z])|\d+")
+RDF_TYPE = "rdf:type"
+VIOLATION = re.compile(r"Problem: '([^']*)': (.*)", re.S)
+# Words that state a fact whose object is not named in the story (a true, a count)
+PREDICATE_WORDS = {
+    "demo:isReserved": re.compile(r"\b(?:reserved|shy|quiet|introvert)\w*", re.I),
+    "demo:isTalkative": re.compile(r"\b(?:talk|chat|convers|gossip)\w*", re.I),
+}
+# Types of the records whose IDs the extractor makes up (see story_chunks.NUMBERED_CATEGORIES)
+GENERATED_TYPES = {"travel:TravelEvent", "travel:WeatherRecord"}
+
+
+def sentence_spans(story: str) -> List[Span]:
+    spans = []
+    start = 0
+    for match in SENTENCE_END.finditer(story):
+        spans.append((start, match.start()))
+        start = match.end()
+    if story[start:].strip():
+        spans.append((start, len(story.rstrip())))
+    return [span for span in spans if span[1] > span[0]]
+
+
+def fact_provenance(story: str, facts: Sequence[Fact]) -> List[List[Span]]:
+    # The sentences each fact was most likely extracted from (see _trace)
+    spans = sentence_spans(story)
+    return [[spans[i] for i in sorted(sentences)] for sentences, _ in _trace(story, facts)[0]]
+
+
+def _trace(story: str, facts: Sequence[Fact]) -> Tuple[List[Tuple[Set[int], bool]], Set[int]]:
+    # The extractor does not say where a fact came from, so a fact is traced to the sentences
+    # that mention both its subject and its object, or else its object ("She works as a
+    # farmer"), or else its subject. A term is mentioned by its local name (see
+    # _mention_patterns) or its literal value; an entity with a made-up ID ("travel:Walk1") is
+    # also mentioned where the values of its facts are, and a true isReserved where "shy" is
+    # (see PREDICATE_WORDS). A fact is anchored when the sentences found mention its object,
+    # so they state the fact rather than only name its subject. Also returns the sentences
+    # that name no term of any fact ("She chatted all day"), which may state a fact about anyone.
+    spans = sentence_spans(story)
+    texts = [story[start:end] for start, end in spans]
+    mentions: Dict[Any, Set[int]] = {}
+
+    def mentioned(term, loose: bool = True) -> Set[int]:
+        # The first of the ways to name the term that finds any sentence; unless loose, only
+        # by all of its words
+        key = (type(term), term, loose)
+        if key not in mentions:
+            mentions[key] = set()
+            for patterns in _mention_patterns(term)[:None if loose else 1]:
+                mentions[key] = {i for i, text in enumerate(texts) if any(p.search(text) for p in patterns)}
+                if mentions[key]:
+                    break
+        return mentions[key]
+
+    subjects: Dict[Any, Set[int]] = {}
+    for s, p, o in facts:
+        if p != RDF_TYPE:
+            subjects.setdefault(s, set()).update(mentioned(o))
+
+    traces = []
+    for s, p, o in facts:
+        # "travel:Weather1" is found where "snow" is before where any "weather" is
+        subject = mentioned(s, loose=False) or subjects.get(s) or mentioned(s)
+        obj = mentioned(o)
+        if not obj and p in PREDICATE_WORDS:
+            obj = {i for i, text in enumerate(texts) if PREDICATE_WORDS[p].search(text)}
+        traces.append(((subject & obj) or obj or subject, bool(obj)))
+    named = set().union(*mentions.values())
+    return traces, {i for i in range(len(spans)) if i not in named}
+
+
+def violation_spans(violation: str, facts: Sequence[Fact], provenance: Sequence[List[Span]],
+                    reads: Optional[Dict[str, Optional[Set[Tuple[Any, Any]]]]] = None) -> Set[Span]:
+    # The sentences of the facts a violation row is about: the facts linking two terms of the
+    # row (e.g. a person and their age), or else the facts about an entity of the row, its
+    # types only when it has nothing else. Given the predicates and classes each rule reads
+    # (see OntologyChecker.rule_reads), only the facts the row's rule reads are taken when
+    # there are any, so conflicting_traits is about isReserved and isTalkative, not all of
+    # the person.
+    match = VIOLATION.match(violation)
+    if match is None:
+        return set()
+    names = {_row_key(term) for term in match.group(2).split(", ")}
+    rule_reads = (reads or {}).get(match.group(1))
+    read = {_row_key(str(p if cls is None else cls)) for p, cls in rule_reads or ()}
+
+    def relevant(indices: List[int]) -> List[int]:
+        return [i for i in indices
+                if _fact_key(facts[i][2] if facts[i][1] == RDF_TYPE else facts[i][1]) in read] or indices
+
+    involved = relevant([i for i, (s, _, o) in enumerate(facts) if _fact_key(s) in names and _fact_key(o) in names])
+    if not involved:
+        about = relevant([i for i, (s, _, _) in enumerate(facts) if _fact_key(s) in names])
+        involved = [i for i in about if facts[i][1] != RDF_TYPE] or about
+    return {span for i in involved for span in provenance[i]}
+
+
+def reextraction(old_story: str, new_story: str, facts: Sequence[Fact]) -> Tuple[List[int], List[Fact]]:
+    # After a rewrite: the indices of the sentences of new_story to extract again, and the
+    # facts extracted from old_story to keep. A fact is kept only when every sentence it was
+    # traced to (see _trace) is still there unchanged. A fact that is not anchored (e.g.
+    # isTalkative) may also have come from a sentence naming no one ("she chatted all day"),
+    # so it is not kept either when such a sentence was edited or removed. A fact traced to
+    # no sentence at all is not kept: nothing tells whether the rewrite removed it. The
+    # sentences of the facts not kept are extracted again along with the new and edited ones.
+    old_spans, new_spans = sentence_spans(old_story), sentence_spans(new_story)
+    matcher = SequenceMatcher(None, [old_story[start:end] for start, end in old_spans],
+                              [new_story[start:end] for start, end in new_spans], autojunk=False)
+    moved: Dict[int, int] = {}
+    for old, new, size in matcher.get_matching_blocks():
+        moved.update((old + k, new + k) for k in range(size))
+    traces, unnamed = _trace(old_story, facts)
+    unnamed_edited = any(j not in moved for j in unnamed)
+
+    keep = [False] * len(facts)
+    for i, (s, p, o) in enumerate(facts):
+        sentences, anchored = traces[i]
+        if p != RDF_TYPE:
+            keep[i] = bool(sentences) and (anchored or not unnamed_edited) and all(j in moved for j in sentences)
+    # Records with made-up IDs are kept or extracted again whole, since the extractor numbers
+    # them anew every time
+    for s in {s for s, p, o in facts if p == RDF_TYPE and o in GENERATED_TYPES}:
+        record = [i for i, fact in enumerate(facts) if fact[0] == s and fact[1] != RDF_TYPE]
+        if not all(keep[i] for i in record):
+            for i in record:
+                keep[i] = False
+    # Types follow their entity: kept with a fact about or pointing to it. An entity with
+    # nothing but types keeps a type its sentences name ("the subway") while they are all
+    # unchanged, and one they do not ("Leo" a demo:Person) while any sentence still names it.
+    kept_terms = {term for i, (s, _, o) in enumerate(facts) if keep[i] for term in (s, o)}
+    described = {s for s, p, _ in facts if p != RDF_TYPE}
+    for i, (s, p, _) in enumerate(facts):
+        if p != RDF_TYPE:
+            continue
+        if s in kept_terms:
+            keep[i] = True
+        elif s not in described:
+            sentences, anchored = traces[i]
+            unchanged = all if anchored else any
+            keep[i] = bool(sentences) and unchanged(j in moved for j in sentences)
+
+    kept_sentences = set(moved.values())
+    indices = {i for i in range(len(new_spans)) if i not in kept_sentences}
+    for i, (s, p, _) in enumerate(facts):
+        if not keep[i] and (p != RDF_TYPE or s not in described):
+            indices.update(moved[j] for j in traces[i][0] if j in moved)
+    return sorted(indices), [fact for fact, kept in zip(facts, keep) if kept]
+
+
+def excerpt(story: str, indices: Sequence[int], context: int = OVERLAP_SENTENCES) -> str:
+    # The given sentences, each after the sentences before it that name who "she" or "the
+    # city" is, in story order
+    spans = sentence_spans(story)
+    selected = sorted({j for i in indices for j in range(max(0, i - context), i + 1)})
+    return " ".join(story[spans[j][0]:spans[j][1]] for j in selected)
+
+
+def splice(story: str, replacements: Dict[Span, str]) -> str:
+    # Replaces the given sentences, from the last one so the earlier offsets stay valid
+    for (start, end), text in sorted(replacements.items(), reverse=True):
+        story = story[:start] + text + story[end:]
+        if not text:
+            # A deleted sentence takes the whitespace after it along
+            story = story[:start] + story[start:].lstrip()
+    return story.strip()
+
+
+def numbered(story: str, spans: Sequence[Span]) -> str:
+    return "\n".join(f"[{n}] {story[start:end]}" for n, (start, end) in enumerate(spans, 1))
+
+
+def parse_numbered(response: str, count: int) -> Optional[List[str]]:
+    # The sentences of a "[n] sentence" response, or None unless there is exactly one for each n
+    sentences = {}
+    for line in response.splitlines():
+        match = re.match(r"\s*\[(\d+)\]\s*(.*)", line)
+        if match and 1 <= int(match.group(1)) <= count:
+            sentences[int(match.group(1))] = match.group(2).strip()
+    if len(sentences) != count:
+        return None
+    return [sentences[n] for n in range(1, count + 1)]
+
+
+def _mention_patterns(term) -> List[List[Pattern]]:
+    # The ways a term may be named, best first, split at capitals with any word ending:
+    # "city:NewYorkCity" as "New York City" or "New York", and only when neither is found as
+    # "city"; "travel:Walking" as "walked"; "travel:Ferry1" as "ferry"; 10000 as "10.000"
+    if isinstance(term, bool):
+        return []
+    if isinstance(term, (int, float)):
+        number = int(term) if float(term).is_integer() else term
+        digits = str(number)
+        if isinstance(number, int) and abs(number) >= 1000:
+            groups = [digits[max(0, end - 3):end] for end in range(len(digits), 0, -3)][::-1]
+            digits = r"[.,\s]?".join(groups)
+        else:
+            digits = re.escape(digits)
+        return [[re.compile(rf"(?<![\d.]){digits}(?:\.0+)?(?!\d)")]]
+    if not isinstance(term, str) or not term:
+        return []
+    words = CAMEL_WORDS.findall(term.split(":", 1)[-1])
+    if not words:
+        return []
+    named = [word for word in words if not word.isdigit()]
+    phrases = [words] + ([words[:-1]] if len(words) > 2 else [])
+    fallbacks = ([named] if named != words else []) + ([named[-1:]] if len(named) > 1 else [])
+    return [[_phrase_pattern(phrase) for phrase in phrases]] + [[_phrase_pattern(phrase)] for phrase in fallbacks]
+
+
+def _phrase_pattern(words: Sequence[str]) -> Pattern:
+    return re.compile(r"\b" + r"\W*".join(_word_pattern(word) for word in words) + r"\b", re.I)
+
+
+def _word_pattern(word: str) -> str:
+    if word.isdigit():
+        return word
+    return re.escape(word[:max(4, len(word) - 3)]) + r"\w*"
+
+
+def _fact_key(term) -> str:
+    if isinstance(term, str):
+        return term.split(":", 1)[-1].lower()
+    return str(term).lower()
+
+
+def _row_key(term: str) -> str:
+    # Row terms are full IRIs or literal values
+    return re.split(r"[#/]", term)[-1].lower() if term.startswith("http") else term.lower()
@@ -0,0 +1,90 @@
+import hashlib
+import json
+import sqlite3
+import time
+from collections import OrderedDict
+from typing import Iterable, List, Optional, Tuple
+
+from rdflib import Graph
+
+# Violations and skipped rules of one check
+CheckResult = Tuple[List[str], List[str]]
+
+
+def fact_set_key(version: str, facts_graph: Graph) -> str:
+    # Canonical form of the resolved facts: order and duplicates in the extractor output,
+    # and prefixed vs. full URIs, do not change the key
+    lines = sorted(" ".join(term.n3() for term in triple) for triple in facts_graph)
+    return hashlib.sha256("\n".join([version] + lines).encode("utf-8")).hexdigest()
+
+
+def version_digest(parts: Iterable[str]) -> str:
+    return hashlib.sha256("\n".join(parts).encode("utf-8")).hexdigest()[:16]
+
+
+class CheckResultCache:
+    # Size-bounded LRU of check results. With a path the entries are also kept in SQLite, so
+    # they survive restarts; the database is trimmed to the same size by last use when the
+    # cache is flushed. Evictions count the entries dropped for good: from the LRU without a
+    # database, else from the database.
+    def __init__(self, max_entries: int = 1024, path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self.db = None
+        if path is not None:
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute("CREATE TABLE IF NOT EXISTS check_results "
+                            "(key TEXT PRIMARY KEY, result TEXT NOT NULL, last_used REAL NOT NULL)")
+            self.db.commit()
+
+    def get(self, key: str) -> Optional[CheckResult]:
+        result = self.entries.get(key)
+        if result is not None:
+            self.entries.move_to_end(key)
+        elif self.db is not None:
+            row = self.db.execute("SELECT result FROM check_results WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                violations, skipped = json.loads(row[0])
+                result = (violations, skipped)
+                self._remember(key, result)
+                self.db.execute("UPDATE check_results SET last_used = ? WHERE key = ?", (time.time(), key))
+                self.db.commit()
+
+        if result is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return list(result[0]), list(result[1])
+
+    def put(self, key: str, result: CheckResult):
+        result = (list(result[0]), list(result[1]))
+        self._remember(key, result)
+        if self.db is not None:
+            self.db.execute("INSERT OR REPLACE INTO check_results VALUES (?, ?, ?)",
+                            (key, json.dumps(result), time.time()))
+            self.db.commit()
+
+    def flush(self):
+        if self.db is not None:
+            cursor = self.db.execute("DELETE FROM check_results WHERE key NOT IN "
+                                     "(SELECT key FROM check_results ORDER BY last_used DESC LIMIT ?)",
+                                     (self.max_entries,))
+            self.evictions += cursor.rowcount
+            self.db.commit()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "size": len(self.entries),
+                "hit_rate": self.hits / lookups if lookups else 0.0}
+
+    def _remember(self, key: str, result: CheckResult):
+        self.entries[key] = result
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            if self.db is None:
+                self.evictions += 1
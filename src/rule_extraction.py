@@ -0,0 +1,225 @@
+import math
+import re
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from facts2triples import clean_and_prefix
+from provenance import sentence_spans
+from story_chunks import CATEGORY_PREFIXES, NUMBERED_CATEGORIES, merge_extractions
+
+NAME = r"([A-Z][a-z]+)"
+NUMBER = r"(\d+(?:\.\d+)?)"
+# Capitalized words that start sentences rather than name someone
+NOT_NAMES = {"a", "an", "the", "he", "she", "it", "they", "we", "i", "you", "his", "her", "their", "its", "this",
+             "that", "these", "those", "there", "here", "in", "on", "at", "as", "but", "and", "or", "so", "then",
+             "when", "while", "after", "afterwards", "before", "however", "despite", "meanwhile", "every", "one"}
+
+# "Alice (17)", "Maria is a 25-year-old Baker", "Jane was only 12 years old"
+AGE_PATTERNS = [
+    re.compile(rf"\b{NAME} \((\d{{1,3}})\)"),
+    re.compile(rf"\b{NAME},? (?:is|was) (?:a|an) (\d{{1,3}})-year-old\b"),
+    re.compile(rf"\b{NAME} (?:is|was|turned) (?:only |just |now )?(\d{{1,3}}) years? old\b"),
+]
+# "Alice (17) and Bob (19) say they are married", "Tina is married to Tom"
+MARRIAGE_PATTERNS = [
+    re.compile(rf"\b{NAME}(?: \(\d+\))? and {NAME}(?: \(\d+\))? (?:\w+ ){{0,3}}?(?:are|were|got) married\b"),
+    re.compile(rf"\b{NAME} (?:is|was|got) married to {NAME}\b"),
+]
+# "Riverton is labeled a LargeCity with 50,000 inhabitants", "Beijing is a small city with 10.000 inhabitants"
+POPULATION = re.compile(rf"\b{NAME} is (?:\w+ ){{0,6}}?with (?:only |about |around |over )?"
+                        r"(\d{1,3}(?:[,.]\d{3})+|\d+) (?:inhabitants|residents|citizens|people)\b")
+CITY_TYPE = re.compile(rf"\b{NAME} is (?:\w+ ){{0,2}}?an? ((?:Large|Small|Walkable|Drivable)City)\b")
+# "a comfortable 21°C"
+TEMPERATURE = re.compile(r"(-?\d+(?:\.\d+)?) ?°C\b")
+# A trip sentence: "Anna decided to walk from Utrecht to Amsterdam in 2 hours"
+TRAVEL_MODES = {"walk": "travel:Walking", "cycl": "travel:Cycling", "bik": "travel:Cycling"}
+TRAVEL_MODE = re.compile(r"\b(walk|cycl|bik)\w*", re.I)
+DURATION = re.compile(rf"\b{NUMBER} (hours?|minutes?)\b")
+DISTANCE = re.compile(rf"\b{NUMBER} ?(km|kilomet(?:er|re)s?|miles?)\b")
+KM_PER_MILE = 1.609
+# Fields the patterns above read off an exact phrase ("Alice (17)", "50,000 inhabitants",
+# "21°C"): their values replace the extractor's. The other values only fill what the extractor
+# left empty: the trip patterns guess which numbers belong to a trip, a city may have more
+# than the one size type found, and a marriage refers to an entity by the pattern's ID.
+EXACT_FIELDS = {"people": ("age",), "cities": ("population",), "weather": ("temperature",)}
+
+# Words of what the extractor is asked about (see UNIVERSAL_PROMPT_TEMPLATE): a sentence with
+# any of them left unmatched by the patterns may hold a fact only the extractor finds
+TOPIC_WORDS = re.compile(
+    r"\b(?:marri|marry|wed|allerg|eat|ate|food|bread|work|job|baker|farmer|live|city|cities|town|village|popul|"
+    r"inhabitant|walk|cycl|bik|driv|car|bus|train|subway|metro|landmark|located|adjacent|next|mountain|hill|"
+    r"terrain|desert|climate|snow|rain|storm|weather|temperature|sun|cloud|wind|anemi|anaemi|cancer|diagnos|"
+    r"obes|ill|sick|reserved|shy|talk|chat|distance|hour|minute|km|mile|euro|dollar|cost|spent|price|harvest|"
+    r"grow|fruit)\w*", re.I)
+
+
+class RuleExtraction(NamedTuple):
+    data: dict  # in the extractor's "data" format
+    sentences: int
+    covered: int  # sentences with nothing left for the extractor
+
+    @property
+    def complete(self) -> bool:
+        # A story the patterns found nothing in is left to the extractor
+        return bool(self.data) and self.covered == self.sentences
+
+
+def extract_rules(story: str) -> RuleExtraction:
+    # Ages, marriages, city populations and size types, temperatures and trip durations and
+    # distances read off the story with patterns
+    people: Dict[str, dict] = {}
+    cities: Dict[str, dict] = {}
+    weather, travels = [], []
+    covered = 0
+    spans = sentence_spans(story)
+    for start, end in spans:
+        sentence = story[start:end]
+        matched: List[Tuple[int, int]] = []
+        for pattern in AGE_PATTERNS:
+            for match in _names(pattern.finditer(sentence)):
+                _entity(people, "demo", match.group(1))["age"] = int(match.group(2))
+                matched.append(match.span())
+        for pattern in MARRIAGE_PATTERNS:
+            for match in _names(pattern.finditer(sentence)):
+                first, second = match.group(1), match.group(2)
+                _entity(people, "demo", first)["isMarriedTo"] = f"demo:{second}"
+                _entity(people, "demo", second)["isMarriedTo"] = f"demo:{first}"
+                matched.append(match.span())
+        for match in _names(POPULATION.finditer(sentence)):
+            _entity(cities, "city", match.group(1))["population"] = int(re.sub(r"[,.]", "", match.group(2)))
+            matched.append(match.span())
+        for match in _names(CITY_TYPE.finditer(sentence)):
+            _entity(cities, "city", match.group(1))["type"] = f"city:{match.group(2)}"
+            matched.append(match.span())
+        for match in TEMPERATURE.finditer(sentence):
+            weather.append({"id": f"travel:Weather{len(weather) + 1}", "temperature": float(match.group(1))})
+            matched.append(match.span())
+        travel = _travel(sentence, len(travels) + 1, matched)
+        if travel is not None:
+            travels.append(travel)
+        if _covered(sentence, matched):
+            covered += 1
+
+    data = {"people": list(people.values()), "cities": list(cities.values()), "weather": weather, "travels": travels}
+    return RuleExtraction({category: entities for category, entities in data.items() if entities}, len(spans), covered)
+
+
+def merge_rule_data(rule_data: dict, data: dict) -> dict:
+    # The extractor's data with the pattern values filled in where it left a field empty, and
+    # put in place of its own for EXACT_FIELDS. Entities with a name are matched by their ID.
+    # Weather records and trips, which the extractor numbers itself, are matched by content
+    # (see _attach), or for weather also one for one in story order when both found as many
+    # records, and only added when it found none in that category.
+    if not rule_data:
+        return data
+    named = {category: entities for category, entities in rule_data.items() if category not in NUMBERED_CATEGORIES}
+    # The first value of a field wins (see merge_extractions)
+    merged = merge_extractions([data, named]) if named else dict(data)
+    for category, entities in named.items():
+        prefix = CATEGORY_PREFIXES[category]
+        by_id = {_id(entity.get("id"), prefix): entity for entity in merged.get(category, [])}
+        for entity in entities:
+            _override(entity, by_id.get(_id(entity["id"], prefix)), category)
+    for category in NUMBERED_CATEGORIES:
+        if category not in rule_data:
+            continue
+        extracted = [dict(entity) for entity in merged.get(category) or [] if isinstance(entity, dict)]
+        if not extracted:
+            merged[category] = list(rule_data[category])
+            continue
+        if category in EXACT_FIELDS and len(extracted) == len(rule_data[category]):
+            for record, target in zip(rule_data[category], extracted):
+                _override(record, target, category)
+                _fill(record, target)
+        else:
+            attached = set()
+            for record in rule_data[category]:
+                _attach(record, extracted, attached)
+        merged[category] = extracted
+    return merged
+
+
+def _override(record: dict, target: Optional[dict], category: str):
+    if target is not None:
+        target.update((field, record[field]) for field in EXACT_FIELDS.get(category, ()) if field in record)
+
+
+def _attach(record: dict, extracted: List[dict], attached: set):
+    # Fills the empty fields of the one extracted record the pattern record agrees with. A
+    # record with every field equal is preferred; with no single candidate nothing is filled.
+    fields = [field for field in record if field != "id"]
+    candidates = [i for i, other in enumerate(extracted)
+                  if i not in attached and all(_agrees(record[field], other.get(field)) for field in fields)]
+    exact = [i for i in candidates if all(_filled(extracted[i].get(field)) for field in fields)]
+    matches = exact if exact else candidates
+    if len(matches) != 1:
+        return
+    attached.add(matches[0])
+    _fill(record, extracted[matches[0]])
+
+
+def _fill(record: dict, target: dict):
+    for field, value in record.items():
+        if field != "id" and not _filled(target.get(field)):
+            target[field] = value
+
+
+def _agrees(value, extracted) -> bool:
+    if not _filled(extracted):
+        return True
+    if isinstance(value, (int, float)):
+        try:
+            return math.isclose(float(extracted), value, rel_tol=0.01)
+        except (TypeError, ValueError):
+            return False
+    return isinstance(extracted, str) and _term(extracted) == _term(value)
+
+
+def _id(value, prefix: str) -> str:
+    return (clean_and_prefix(value, prefix) or "").lower() if isinstance(value, str) else ""
+
+
+def _term(value: str) -> str:
+    return (clean_and_prefix(value, "travel") or "").lower()
+
+
+def _filled(value) -> bool:
+    return value is not None and value != "" and value != []
+
+
+def _names(matches):
+    return [match for match in matches if match.group(1).lower() not in NOT_NAMES]
+
+
+def _entity(entities: Dict[str, dict], prefix: str, name: str) -> dict:
+    return entities.setdefault(name, {"id": f"{prefix}:{name}"})
+
+
+def _travel(sentence: str, number: int, matched: List[Tuple[int, int]]):
+    modes = {TRAVEL_MODES[match.group(1).lower()] for match in TRAVEL_MODE.finditer(sentence)}
+    durations, distances = list(DURATION.finditer(sentence)), list(DISTANCE.finditer(sentence))
+    if len(modes) != 1 or len(durations) > 1 or len(distances) > 1 or not durations + distances:
+        return None
+    travel = {"id": f"travel:Trip{number}", "mode": modes.pop()}
+    if durations:
+        hours = float(durations[0].group(1))
+        travel["duration"] = hours / 60 if durations[0].group(2).startswith("minute") else hours
+    if distances:
+        km = float(distances[0].group(1))
+        travel["distance"] = km * KM_PER_MILE if distances[0].group(2).startswith("mile") else km
+    matched.extend(match.span() for match in TRAVEL_MODE.finditer(sentence))
+    matched.extend(match.span() for match in durations + distances)
+    return travel
+
+
+def _covered(sentence: str, matched: List[Tuple[int, int]]) -> bool:
+    # Nothing of interest left once the matched text is blanked out: no number, no name past
+    # the first word and no topic word
+    rest = list(sentence)
+    for start, end in matched:
+        rest[start:end] = " " * (end - start)
+    rest = "".join(rest)
+    words = rest.split()
+    if words and words[0].lower().strip(",;:") in NOT_NAMES:
+        words = words[1:]
+    rest = " ".join(words)
+    return not re.search(r"\d|\b[A-Z]", rest) and not TOPIC_WORDS.search(rest)
@@ -0,0 +1,67 @@
+from typing import Any, Iterable, Optional, Set, Tuple
+
+from rdflib import URIRef
+from rdflib.namespace import RDF
+from rdflib.plugins.sparql.parserutils import CompValue
+from rdflib.plugins.sparql.sparql import Query
+
+# (predicate, None) requires some triple with that predicate,
+# (rdf:type, class) requires some instance of that class.
+Requirement = Tuple[Any, Any]
+
+
+def derive_requirements(query: Query) -> Set[Requirement]:
+    # Predicates and classes that every solution of the query has to match
+    return _required(query.algebra)
+
+
+def derive_reads(query: Query) -> Optional[Set[Requirement]]:
+    # Every predicate and class the query can match anywhere, including optional parts and
+    # NOT EXISTS patterns, or None when a pattern has a variable predicate (reads everything).
+    # Rules whose reads do not change between two fact sets return the same rows.
+    reads = set()
+    return reads if _collect_reads(query.algebra, reads) else None
+
+
+def present_terms(triples: Iterable[Tuple[Any, Any, Any]]) -> Set[Requirement]:
+    terms = set()
+    for _, p, o in triples:
+        terms.add((p, None))
+        if p == RDF.type:
+            terms.add((p, o))
+    return terms
+
+
+def _required(node) -> Set[Requirement]:
+    if not isinstance(node, CompValue):
+        return set()
+    if node.name == "BGP":
+        requirements = set()
+        for _, p, o in node.triples:
+            if isinstance(p, URIRef):
+                requirements.add((p, o if p == RDF.type and isinstance(o, URIRef) else None))
+        return requirements
+    if node.name == "Union":
+        # Only what both branches need is required
+        return _required(node.p1) & _required(node.p2)
+    if node.name in ("LeftJoin", "Minus"):
+        return _required(node.p1)
+    if node.name == "Join":
+        return _required(node.p1) | _required(node.p2)
+    # Filter expressions (including NOT EXISTS) never make a pattern required
+    return _required(node.get("p"))
+
+
+def _collect_reads(node, reads: Set[Requirement]) -> bool:
+    if isinstance(node, (list, tuple)):
+        return all(_collect_reads(item, reads) for item in node)
+    if not isinstance(node, CompValue):
+        return True
+    # NOT EXISTS patterns stay untranslated triple blocks in the algebra
+    if node.name in ("BGP", "TriplesBlock"):
+        for _, p, o in node.triples:
+            if not isinstance(p, URIRef):
+                return False
+            reads.add((p, o if p == RDF.type and isinstance(o, URIRef) else None))
+        return True
+    return all(_collect_reads(value, reads) for value in node.values())
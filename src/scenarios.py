@@ -664,3 +664,133 @@ ALL_SCENARIOS = [
     STORY_15,
 ]
 '''
+
+# Representative extractor output (as produced by convert_schema_to_triples) for every scenario.
+# Used to compare the native rule engine against the SPARQL queries and for benchmarks without an LLM.
+SCENARIO_FACTS = {
+    "STORY_1": [
+        ("demo:Maria", "rdf:type", "demo:Person"), ("demo:Maria", "demo:livesIn", "city:Florence"),
+        ("demo:Maria", "demo:hasAge", 25), ("demo:Maria", "demo:isAllergicTo", "ia2025:Flour"),
+        ("demo:Maria", "demo:worksAs", "demo:Baker"), ("demo:Maria", "demo:eats", "ia2025:Bread"),
+        ("city:Florence", "rdf:type", "city:City"),
+    ],
+    "STORY_2": [
+        ("demo:Tom", "rdf:type", "demo:Person"), ("demo:Tom", "demo:livesIn", "city:Beijing"),
+        ("city:Beijing", "rdf:type", "city:City"), ("city:Beijing", "rdf:type", "city:DrivableCity"),
+    ],
+    "STORY_3": [
+        ("demo:Alice", "rdf:type", "demo:Person"), ("demo:Alice", "demo:hasAge", 17),
+        ("demo:Alice", "demo:isMarriedTo", "demo:Bob"),
+        ("demo:Bob", "rdf:type", "demo:Person"), ("demo:Bob", "demo:hasAge", 19),
+        ("demo:Bob", "demo:isMarriedTo", "demo:Alice"),
+    ],
+    "STORY_4": [
+        ("demo:Luca", "rdf:type", "demo:Person"), ("demo:Luca", "demo:isReserved", True),
+        ("demo:Luca", "demo:isTalkative", True),
+    ],
+    "STORY_5": [
+        ("demo:Tina", "rdf:type", "demo:Person"), ("demo:Tina", "demo:worksAs", "demo:Baker"),
+    ],
+    "STORY_6": [
+        ("demo:Marco", "rdf:type", "demo:Person"), ("demo:Marco", "demo:isAllergicTo", "ia2025:Flour"),
+        ("demo:Marco", "demo:eats", "ia2025:Bread"), ("demo:Marco", "demo:eats", "ia2025:Pizza"),
+    ],
+    "STORY_7": [
+        ("demo:Alice", "rdf:type", "demo:Person"), ("demo:Alice", "demo:hasCondition", "base:Anemia"),
+        ("demo:Alice", "demo:hasCondition", "base:Cancer"),
+    ],
+    "STORY_8": [
+        ("city:Hillsburg", "rdf:type", "city:City"), ("city:Hillsburg", "rdf:type", "city:WalkableCity"),
+        ("city:Hillsburg", "city:hasTerrain", "city:Mountainous"),
+    ],
+    "STORY_9": [
+        ("city:EmpireStateBuilding", "rdf:type", "city:Landmark"),
+        ("city:EmpireStateBuilding", "city:locatedIn", "city:NewYorkCity"),
+        ("city:EmpireStateBuilding", "city:locatedIn", "city:LosAngeles"),
+    ],
+    "STORY_10": [
+        ("city:MetroX", "rdf:type", "city:SubwaySystem"),
+    ],
+    "STORY_11": [
+        ("city:Riverton", "rdf:type", "city:City"), ("city:Riverton", "rdf:type", "city:LargeCity"),
+        ("city:Riverton", "city:hasPopulation", 50000),
+    ],
+    "STORY_12": [
+        ("city:Utrecht", "rdf:type", "city:City"), ("city:Amsterdam", "rdf:type", "city:City"),
+        ("city:Utrecht", "city:adjacentTo", "city:Amsterdam"),
+    ],
+    "STORY_13": [
+        ("city:SaharaVillage", "rdf:type", "city:City"), ("city:SaharaVillage", "travel:hasClimateZone", "travel:Desert"),
+        ("travel:SaharaClimate", "rdf:type", "travel:Climate"),
+        ("travel:SaharaClimate", "travel:hasClimateZone", "travel:Desert"),
+        ("travel:SaharaClimate", "travel:allowsForFood", "ia2025:GenericFood"),
+    ],
+    "STORY_14": [
+        ("travel:HardcodedWeather", "rdf:type", "travel:WeatherRecord"),
+        ("travel:HardcodedWeather", "travel:weatherHasState", "travel:Snow"),
+        ("travel:HardcodedWeather", "travel:temperature", 21.0),
+    ],
+    "STORY_15": [
+        ("demo:Anna", "rdf:type", "demo:Person"),
+        ("travel:Walk1", "rdf:type", "travel:TravelEvent"), ("travel:Walk1", "travel:hasTravelMode", "travel:Walking"),
+        ("travel:Walk1", "travel:travelDistance", 400.0), ("travel:Walk1", "travel:travelDurationHours", 2.0),
+        ("travel:Walk1", "travel:travelCost", 5.0),
+        ("travel:Cycle1", "rdf:type", "travel:TravelEvent"), ("travel:Cycle1", "travel:hasTravelMode", "travel:Cycling"),
+        ("travel:Cycle1", "travel:travelDistance", 1500.0), ("travel:Cycle1", "travel:travelDurationHours", 1.0),
+        ("travel:Cycle1", "travel:travelCost", 5.0),
+    ],
+    "LARGE_STORY_1": [
+        ("demo:Tina", "rdf:type", "demo:Person"), ("demo:Tina", "demo:livesIn", "city:Beijing"),
+        ("demo:Tina", "demo:hasAge", 17), ("demo:Tina", "demo:isMarriedTo", "demo:Tom"),
+        ("demo:Tina", "demo:isAllergicTo", "ia2025:Flour"), ("demo:Tina", "demo:worksAs", "demo:Baker"),
+        ("demo:Tina", "demo:isReserved", True), ("demo:Tina", "demo:eats", "ia2025:Bread"),
+        ("demo:Tina", "demo:isTalkative", True),
+        ("demo:Tom", "rdf:type", "demo:Person"), ("demo:Tom", "demo:livesIn", "city:Beijing"),
+        ("demo:Tom", "demo:hasAge", 23),
+        ("city:Beijing", "rdf:type", "city:City"), ("city:Beijing", "rdf:type", "city:DrivableCity"),
+        ("city:Beijing", "rdf:type", "city:SmallCity"), ("city:Beijing", "city:hasPopulation", 10000),
+        ("travel:Weather1", "rdf:type", "travel:WeatherRecord"),
+        ("travel:Weather1", "travel:weatherHasState", "travel:Snow"), ("travel:Weather1", "travel:temperature", 30.0),
+    ],
+    "LARGE_STORY_2": [
+        ("demo:Maya", "rdf:type", "demo:Person"), ("demo:Maya", "demo:worksAs", "demo:Farmer"),
+        ("demo:Maya", "demo:hasCondition", "base:Anemia"), ("demo:Maya", "demo:hasCondition", "base:Cancer"),
+        ("city:SaharaVillage", "rdf:type", "city:City"),
+        ("city:Utrecht", "rdf:type", "city:City"), ("city:Utrecht", "rdf:type", "city:WalkableCity"),
+        ("city:Utrecht", "city:hasTerrain", "city:Mountainous"), ("city:Utrecht", "city:adjacentTo", "city:Amsterdam"),
+        ("city:Amsterdam", "rdf:type", "city:City"),
+        ("city:DomToren", "rdf:type", "city:Landmark"), ("city:DomToren", "city:locatedIn", "city:Utrecht"),
+        ("city:DomToren", "city:locatedIn", "city:Amsterdam"),
+        ("travel:Walk1", "rdf:type", "travel:TravelEvent"), ("travel:Walk1", "travel:hasTravelMode", "travel:Walking"),
+        ("travel:Walk1", "travel:travelDistance", 45.0), ("travel:Walk1", "travel:travelCost", 5.0),
+        ("travel:Cycle1", "rdf:type", "travel:TravelEvent"), ("travel:Cycle1", "travel:hasTravelMode", "travel:Cycling"),
+        ("travel:Cycle1", "travel:travelDistance", 60.0), ("travel:Cycle1", "travel:travelDurationHours", 1.0),
+        ("travel:SaharaClimate", "rdf:type", "travel:Climate"),
+        ("city:SaharaVillage", "travel:hasClimateZone", "travel:Desert"),
+        ("travel:SaharaClimate", "travel:hasClimateZone", "travel:Desert"),
+        ("travel:SaharaClimate", "travel:allowsForFood", "ia2025:GenericFood"),
+    ],
+    "LARGE_STORY_3": [
+        ("demo:Jake", "rdf:type", "demo:Person"), ("demo:Jake", "demo:worksAs", "demo:Fisher"),
+        ("demo:Tom", "rdf:type", "demo:Person"), ("demo:Tom", "demo:worksAs", "demo:Baker"),
+        ("demo:Mark", "rdf:type", "demo:Person"), ("demo:Mark", "demo:isReserved", True),
+        ("demo:Sam", "rdf:type", "demo:Person"), ("demo:Sam", "demo:worksAs", "demo:Baker"),
+        ("demo:Sam", "demo:worksAs", "demo:Teacher"),
+        ("city:Willowbrook", "rdf:type", "city:City"),
+        ("travel:Trip1", "rdf:type", "travel:TravelEvent"), ("travel:Trip1", "travel:hasTravelMode", "travel:Boat"),
+        ("travel:Trip2", "rdf:type", "travel:TravelEvent"), ("travel:Trip2", "travel:hasTravelMode", "travel:Car"),
+    ],
+    "LARGE_STORY_4": [
+        ("demo:Amira", "rdf:type", "demo:Person"), ("demo:Leo", "rdf:type", "demo:Person"),
+        ("demo:Cass", "rdf:type", "demo:Person"), ("demo:Jonah", "rdf:type", "demo:Person"),
+        ("city:NewYorkCity", "rdf:type", "city:City"),
+        ("city:CentralPark", "rdf:type", "city:Park"), ("city:CentralPark", "city:locatedIn", "city:NewYorkCity"),
+        ("city:EmpireStateBuilding", "rdf:type", "city:Building"),
+        ("city:EmpireStateBuilding", "city:locatedIn", "city:NewYorkCity"),
+        ("city:CitySubway", "rdf:type", "city:SubwaySystem"),
+        ("travel:Walk1", "rdf:type", "travel:TravelEvent"), ("travel:Walk1", "travel:hasTravelMode", "travel:Walking"),
+        ("travel:Walk1", "travel:travelDistance", 16.0), ("travel:Walk1", "travel:travelDurationHours", 0.5),
+        ("travel:Ferry1", "rdf:type", "travel:TravelEvent"), ("travel:Ferry1", "travel:hasTravelMode", "travel:Boat"),
+        ("travel:Ferry1", "travel:travelCost", 4.0),
+    ],
+}
@@ -0,0 +1,141 @@
+import re
+from typing import Dict, List, Optional
+
+from facts2triples import clean_and_prefix
+
+# Stories longer than this many words are extracted in chunks of about this size
+CHUNK_WORDS = 250
+# Sentences repeated at the start of the next chunk, so that the entity a sentence refers
+# back to ("she", "the city") is still named in the same chunk
+OVERLAP_SENTENCES = 1
+
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+
+# The categories of the extractor's "data" object and the default prefix of their IDs
+CATEGORY_PREFIXES = {"people": "demo", "cities": "city", "landmarks": "city", "climates": "travel",
+                     "weather": "travel", "travels": "travel"}
+# Categories the extractor numbers the IDs of itself in every response (travel:Walk1,
+# travel:Weather1): the same ID in two chunks names two different records
+NUMBERED_CATEGORIES = ("weather", "travels")
+# Fields that hold the ID of another entity, and the default prefix of those IDs
+REFERENCE_FIELDS = {"isMarriedTo": "demo", "livesInCityID": "city", "isAdjacentTo": "city", "locatedIn": "city"}
+
+
+def split_story(story: str, max_words: int = CHUNK_WORDS, overlap: int = OVERLAP_SENTENCES) -> List[str]:
+    # Short stories are a single chunk. Long ones are cut at paragraph breaks, and paragraphs
+    # still longer than max_words into windows of whole sentences.
+    if len(story.split()) <= max_words:
+        return [story]
+    chunks = []
+    for paragraph in PARAGRAPH_BREAK.split(story):
+        sentences = [sentence for sentence in SENTENCE_END.split(paragraph.strip()) if sentence]
+        window = []
+        for sentence in sentences:
+            if window and _words(window + [sentence]) > max_words and len(window) > overlap:
+                chunks.append(" ".join(window))
+                window = window[-overlap:] if overlap else []
+            window.append(sentence)
+        if window:
+            chunks.append(" ".join(window))
+    return chunks
+
+
+def merge_extractions(chunk_data: List[dict]) -> dict:
+    # Merges the "data" objects of the chunks of one story. The same named entity extracted
+    # from several chunks (e.g. "demo:Tina" and "Tina") becomes one object: the first value
+    # of every field is kept and list fields are joined. References to other entities are
+    # rewritten to the ID the entity was merged under. Numbered records are kept apart: their
+    # IDs are scoped to the chunk (see scope_ids), and a record a later chunk repeats word for
+    # word, e.g. from an overlap sentence, is dropped.
+    aliases = {}
+    merged: Dict[str, Dict[str, dict]] = {category: {} for category in CATEGORY_PREFIXES}
+    for index, data in enumerate(chunk_data):
+        if index:
+            data = scope_ids(data, f"c{index}")
+        for category, prefix in CATEGORY_PREFIXES.items():
+            # The records of the earlier chunks, which this one may repeat
+            earlier = [_content(entity) for entity in merged[category].values()]
+            for entity in _entities(data, category):
+                key = _entity_key(entity.get("id"), prefix)
+                if key is None:
+                    continue
+                if category in NUMBERED_CATEGORIES:
+                    if _content(entity) not in earlier:
+                        merged[category][key] = dict(entity)
+                    continue
+                aliases.setdefault(_name_key(key), clean_and_prefix(entity["id"], prefix))
+                if key in merged[category]:
+                    _merge_entity(merged[category][key], entity)
+                else:
+                    merged[category][key] = dict(entity)
+
+    result = {}
+    for category, entities in merged.items():
+        for entity in entities.values():
+            _resolve_references(entity, aliases)
+        if entities:
+            result[category] = list(entities.values())
+    return result
+
+
+def scope_ids(data: dict, scope: str) -> dict:
+    # The data with the IDs of its numbered records suffixed with scope, so they cannot
+    # collide with the records of another chunk or extraction of the same story
+    scoped = dict(data)
+    for category in NUMBERED_CATEGORIES:
+        if category in scoped:
+            scoped[category] = [dict(entity, id=f"{entity['id']}_{scope}") if isinstance(entity.get("id"), str)
+                                else entity for entity in _entities(data, category)]
+    return scoped
+
+
+def _words(sentences: List[str]) -> int:
+    return sum(len(sentence.split()) for sentence in sentences)
+
+
+def _entities(data: dict, category: str) -> List[dict]:
+    entities = data.get(category) if isinstance(data, dict) else None
+    return [entity for entity in entities if isinstance(entity, dict)] if isinstance(entities, list) else []
+
+
+def _entity_key(entity_id, prefix: str) -> Optional[str]:
+    # The ID facts2triples would resolve the entity to, case-insensitively
+    if not isinstance(entity_id, str):
+        return None
+    resolved = clean_and_prefix(entity_id, prefix)
+    return resolved.lower() if resolved else None
+
+
+def _content(entity: dict) -> dict:
+    return {field: value for field, value in entity.items() if field != "id"}
+
+
+def _name_key(entity_key: str) -> str:
+    # The name without its prefix: a reference may use another prefix than the entity itself
+    return entity_key.split(":", 1)[-1]
+
+
+def _merge_entity(target: dict, entity: dict):
+    for field, value in entity.items():
+        current = target.get(field)
+        if current is None or current == [] or current == "":
+            target[field] = value
+        elif isinstance(current, list) or isinstance(value, list):
+            values = current if isinstance(current, list) else [current]
+            additions = value if isinstance(value, list) else [value]
+            target[field] = values + [item for item in additions if item not in values]
+
+
+def _resolve_references(entity: dict, aliases: Dict[str, str]):
+    for field, prefix in REFERENCE_FIELDS.items():
+        value = entity.get(field)
+        if isinstance(value, list):
+            entity[field] = [_resolve(item, prefix, aliases) for item in value]
+        elif value is not None:
+            entity[field] = _resolve(value, prefix, aliases)
+
+
+def _resolve(reference, prefix: str, aliases: Dict[str, str]):
+    key = _entity_key(reference, prefix)
+    return aliases.get(_name_key(key), reference) if key is not None else reference
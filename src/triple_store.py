@@ -0,0 +1,267 @@
+from array import array
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from rdflib import Graph
+from rdflib.store import Store
+from rdflib.term import Node
+
+Triple = Tuple[Any, Any, Any]
+
+# Marks a removed row in the columns
+REMOVED = -1
+# First ID of the terms an overlay dictionary interns, far above any ontology's term count
+OVERLAY_OFFSET = 1 << 40
+
+
+class TermDictionary:
+    # Interns every RDF term once into an integer ID. Stores sharing a dictionary share the IDs,
+    # so the ontology closure and all the story layers built on top of it store each term once.
+    # A dictionary with a parent is an overlay: it resolves the parent's terms to the parent's
+    # IDs and only interns the terms new to both, under IDs from OVERLAY_OFFSET on. Stories
+    # intern into an overlay of the ontology's dictionary, which goes away with their graphs.
+    def __init__(self, parent: Optional["TermDictionary"] = None):
+        self.parent = parent
+        self.offset = OVERLAY_OFFSET if parent is not None else 0
+        self.ids: Dict[Node, int] = {}
+        self.terms: List[Node] = []
+
+    def intern(self, term: Node) -> int:
+        term_id = self.lookup(term)
+        if term_id is None:
+            term_id = self.ids[term] = self.offset + len(self.terms)
+            self.terms.append(term)
+        return term_id
+
+    def lookup(self, term: Node) -> Optional[int]:
+        # The overlay's own ID comes first: a term it interned before the parent did keeps it
+        term_id = self.ids.get(term)
+        if term_id is None and self.parent is not None:
+            term_id = self.parent.lookup(term)
+        return term_id
+
+    def term(self, term_id: int) -> Node:
+        if term_id < self.offset:
+            return self.parent.term(term_id)
+        return self.terms[term_id - self.offset]
+
+    def decoder(self) -> Callable[[int], Node]:
+        # The fastest way to turn IDs of this dictionary back into terms
+        return self.terms.__getitem__ if self.parent is None else self.term
+
+    def __len__(self) -> int:
+        return len(self.terms)
+
+
+class InternedStore(Store):
+    # A triple store over interned term IDs: one row per triple in three array-backed columns
+    # (subject, predicate, object), with SPO, POS and OSP indexes mapping the first two IDs of
+    # a pattern to the rows that match them. It implements the rdflib Store API, so a
+    # Graph(store=InternedStore(...)) works everywhere a Graph does, SPARQL included (rdflib
+    # evaluates the queries itself through triples()). Contexts and events are not supported.
+    context_aware = False
+    formula_aware = False
+    graph_aware = False
+    transaction_aware = False
+
+    def __init__(self, terms: Optional[TermDictionary] = None, configuration=None, identifier=None):
+        super().__init__(configuration)
+        self.identifier = identifier
+        self.terms = terms if terms is not None else TermDictionary()
+        self.subjects = array("q")
+        self.predicates = array("q")
+        self.objects = array("q")
+        self.spo: Dict[int, Dict[int, array]] = {}
+        self.pos: Dict[int, Dict[int, array]] = {}
+        self.osp: Dict[int, Dict[int, array]] = {}
+        self.size = 0
+        self._namespace: Dict[str, Any] = {}
+        self._prefix: Dict[Any, str] = {}
+
+    # Fast paths used by the reasoner, without the (triple, contexts) pairs of the Store API
+    def has(self, triple: Triple) -> bool:
+        return self._row(triple) is not None
+
+    def add_triple(self, triple: Triple) -> bool:
+        # Returns whether the triple was new
+        s, p, o = (self.terms.intern(term) for term in triple)
+        if self._find(self.spo, s, p, self.objects, o) is not None:
+            return False
+        row = len(self.subjects)
+        self.subjects.append(s)
+        self.predicates.append(p)
+        self.objects.append(o)
+        _index(self.spo, s, p, row)
+        _index(self.pos, p, o, row)
+        _index(self.osp, o, s, row)
+        self.size += 1
+        return True
+
+    def remove_triple(self, triple: Triple) -> bool:
+        row = self._row(triple)
+        if row is None:
+            return False
+        s, p, o = self.subjects[row], self.predicates[row], self.objects[row]
+        _unindex(self.spo, s, p, row)
+        _unindex(self.pos, p, o, row)
+        _unindex(self.osp, o, s, row)
+        self.subjects[row] = self.predicates[row] = self.objects[row] = REMOVED
+        self.size -= 1
+        return True
+
+    def copy(self) -> "InternedStore":
+        # A copy over the same term dictionary, made from the ID columns and indexes without
+        # resolving a single term. Removed rows are kept as they are, unless they outnumber
+        # the triples, in which case the copy is compacted.
+        store = InternedStore(self.terms)
+        if len(self.subjects) - self.size <= self.size:
+            store.subjects = array("q", self.subjects)
+            store.predicates = array("q", self.predicates)
+            store.objects = array("q", self.objects)
+            store.spo, store.pos, store.osp = (
+                {first: {second: array("q", rows) for second, rows in inner.items()} for first, inner in index.items()}
+                for index in (self.spo, self.pos, self.osp))
+        else:
+            for s, p, o in zip(self.subjects, self.predicates, self.objects):
+                if s != REMOVED:
+                    row = len(store.subjects)
+                    store.subjects.append(s)
+                    store.predicates.append(p)
+                    store.objects.append(o)
+                    _index(store.spo, s, p, row)
+                    _index(store.pos, p, o, row)
+                    _index(store.osp, o, s, row)
+        store.size = self.size
+        return store
+
+    def rows_since(self, row: int) -> Iterator[Triple]:
+        # The triples added after the store had this many rows (see copy), still present
+        term = self.terms.decoder()
+        return ((term(self.subjects[i]), term(self.predicates[i]), term(self.objects[i]))
+                for i in range(row, len(self.subjects)) if self.subjects[i] != REMOVED)
+
+    def match(self, pattern: Triple) -> Iterator[Triple]:
+        rows = self._rows(pattern)
+        if rows is None:
+            return iter(())
+        term = self.terms.decoder()
+        return ((term(self.subjects[row]), term(self.predicates[row]), term(self.objects[row])) for row in rows)
+
+    # rdflib Store API
+    def add(self, triple: Triple, context=None, quoted: bool = False) -> None:
+        self.add_triple(triple)
+
+    def addN(self, quads) -> None:
+        for s, p, o, _ in quads:
+            self.add_triple((s, p, o))
+
+    def remove(self, triple_pattern: Triple, context=None) -> None:
+        for triple in list(self.match(triple_pattern)):
+            self.remove_triple(triple)
+
+    def triples(self, triple_pattern: Triple, context=None):
+        for triple in self.match(triple_pattern):
+            yield triple, iter(())
+
+    def __len__(self, context=None) -> int:
+        return self.size
+
+    def contexts(self, triple=None):
+        return iter(())
+
+    def bind(self, prefix: str, namespace, override: bool = True) -> None:
+        # Same behaviour as rdflib's SimpleMemory.bind
+        bound_namespace = self._namespace.get(prefix)
+        bound_prefix = self._prefix.get(namespace)
+        if bound_prefix is None:
+            bound_prefix = self._prefix.get(bound_namespace)
+        if override:
+            if bound_prefix is not None:
+                del self._namespace[bound_prefix]
+            if bound_namespace is not None:
+                del self._prefix[bound_namespace]
+            self._prefix[namespace] = prefix
+            self._namespace[prefix] = namespace
+        else:
+            self._prefix[bound_namespace if bound_namespace is not None else namespace] = (
+                bound_prefix if bound_prefix is not None else prefix)
+            self._namespace[bound_prefix if bound_prefix is not None else prefix] = (
+                bound_namespace if bound_namespace is not None else namespace)
+
+    def namespace(self, prefix: str):
+        return self._namespace.get(prefix)
+
+    def prefix(self, namespace) -> Optional[str]:
+        return self._prefix.get(namespace)
+
+    def namespaces(self):
+        yield from self._namespace.items()
+
+    def _row(self, triple: Triple) -> Optional[int]:
+        s, p, o = (self.terms.lookup(term) for term in triple)
+        if s is None or p is None or o is None:
+            return None
+        return self._find(self.spo, s, p, self.objects, o)
+
+    @staticmethod
+    def _find(index: Dict[int, Dict[int, array]], first: int, second: int, column: array,
+              third: int) -> Optional[int]:
+        for row in index.get(first, {}).get(second, ()):
+            if column[row] == third:
+                return row
+        return None
+
+    def _rows(self, pattern: Triple) -> Optional[List[int]]:
+        # The rows matching a pattern, read from the index whose leading positions are bound.
+        # They are copied out, so the store can change while the matches are consumed.
+        ids = []
+        for term in pattern:
+            if term is None:
+                ids.append(None)
+                continue
+            term_id = self.terms.lookup(term)
+            if term_id is None:
+                return None
+            ids.append(term_id)
+        s, p, o = ids
+
+        if s is not None:
+            if p is not None:
+                rows = self.spo.get(s, {}).get(p, ())
+                return [row for row in rows if o is None or self.objects[row] == o]
+            if o is not None:
+                return list(self.osp.get(o, {}).get(s, ()))
+            return [row for rows in self.spo.get(s, {}).values() for row in rows]
+        if p is not None:
+            if o is not None:
+                return list(self.pos.get(p, {}).get(o, ()))
+            return [row for rows in self.pos.get(p, {}).values() for row in rows]
+        if o is not None:
+            return [row for rows in self.osp.get(o, {}).values() for row in rows]
+        return [row for row in range(len(self.subjects)) if self.subjects[row] != REMOVED]
+
+
+def _index(index: Dict[int, Dict[int, array]], first: int, second: int, row: int):
+    rows = index.setdefault(first, {}).get(second)
+    if rows is None:
+        index[first][second] = array("q", (row,))
+    else:
+        rows.append(row)
+
+
+def _unindex(index: Dict[int, Dict[int, array]], first: int, second: int, row: int):
+    inner = index[first]
+    rows = inner[second]
+    rows.remove(row)
+    if not rows:
+        del inner[second]
+        if not inner:
+            del index[first]
+
+
+def interned_graph(terms: TermDictionary, triples=()) -> Graph:
+    # A Graph backed by an InternedStore, filled with the given triples
+    graph = Graph(store=InternedStore(terms))
+    store = graph.store
+    for triple in triples:
+        store.add_triple(triple)
+    return graph